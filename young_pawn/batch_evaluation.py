@@ -0,0 +1,55 @@
+"""
+Scores many positions in one go with NumPy, for analysis jobs that go through
+far more positions than a search does.
+
+Boards are (N, 8, 8) integer arrays of `chess_engine.PIECE_CODES`, with 0 for
+an empty square, the same codes `GameState.snapshot` packs. The scores are
+those of `chess_ai.score_board` and `chess_ai.weighted_score_board` for
+positions where the game isn't over, which a board alone can't tell.
+"""
+
+import numpy as np
+
+from chess_ai import SCORE_SCALE, SQUARE_VALUES, piece_value
+from chess_engine import PIECE_CODES, PIECE_NAMES
+
+
+# Indexed by piece code, then row and column for the square values. Black's
+# values are negative and the empty square is worth 0.
+MATERIAL_VALUES = np.zeros(len(PIECE_NAMES), dtype=np.int64)
+SQUARE_VALUE_TABLES = np.zeros((len(PIECE_NAMES), 8, 8), dtype=np.int64)
+
+for code, piece in enumerate(PIECE_NAMES[1:], 1):
+    MATERIAL_VALUES[code] = piece_value[piece[1]] * (1 if piece[0] == "w" else -1)
+    SQUARE_VALUE_TABLES[code] = SQUARE_VALUES[piece]
+
+_ROWS = np.arange(8).reshape(8, 1)
+_COLS = np.arange(8).reshape(1, 8)
+
+
+def encode_boards(game_states):
+    """
+    Stacks the boards of `game_states` into an (N, 8, 8) array of piece codes.
+    """
+    codes = [
+        [PIECE_CODES[piece] for row in game_state.board for piece in row]
+        for game_state in game_states
+    ]
+
+    return np.array(codes, dtype=np.uint8).reshape(-1, 8, 8)
+
+
+def material_scores(boards):
+    """
+    `score_board` of each board, as an array of N integers.
+    """
+    return MATERIAL_VALUES[np.asarray(boards)].sum(axis=(1, 2))
+
+
+def weighted_scores(boards):
+    """
+    `weighted_score_board` of each board, as an array of N floats.
+    """
+    values = SQUARE_VALUE_TABLES[np.asarray(boards), _ROWS, _COLS]
+
+    return values.sum(axis=(1, 2)) / SCORE_SCALE
@@ -2,9 +2,20 @@
 This AI will select chess moves that it sees fit for the current position.
 """
 
+import multiprocessing
 import random as r
+import time
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
 
+from chess_engine import GameState, Move
+from transposition_table import (
+    EXACT,
+    LOWER_BOUND,
+    UPPER_BOUND,
+    TranspositionTable,
+)
+
 
 piece_value = {
     "K": 100,
@@ -17,6 +28,16 @@ piece_value = {
 CHECKMATE = 1000
 STALEMATE = 0
 DEPTH = 2
+MAX_DEPTH = 32  # Deepest iteration when searching to a time or node budget
+ASPIRATION_WINDOW = 0.5  # Half-width of the root window around the last score
+SHARED_ALPHA_INTERVAL = 1024  # Nodes between looks at a parallel search's alpha
+NULL_MOVE_REDUCTION = 2  # How much shallower the search after a pass is
+LATE_MOVE_COUNT = 4  # Moves searched in full before late move reductions
+LATE_MOVE_DEPTH = 3  # Shallowest depth late move reductions apply at
+TRANSPOSITION_TABLE_MB = 16
+SCORE_SCALE = 40  # Running scores are kept in 1/40ths, so they add up exactly
+VERIFY_EVALUATION = False  # Check the running score against a full scan
+NULL_WINDOW = 0.5 / SCORE_SCALE  # Narrower than any two scores are apart
 white_pawn_scores = [
     [0 * val for val in range(8)],
     [0.5, 0.75, 1.0, 1.5, 1.5, 1.0, 0.75, 0.5],
@@ -73,6 +94,28 @@ piece_position_score = {
 }
 
 
+def square_value(piece, row, col):
+    """
+    What a piece on a square adds to its side's `weighted_score_board` score.
+    """
+    kind = piece[1]
+    position_scores = piece_position_score[piece if kind in ("p", "K") else kind]
+
+    return piece_value[kind] + position_scores[row][col] * 0.5
+
+
+# square_value in 1/SCORE_SCALE units, negative for black, for the running
+# score the game state keeps
+SQUARE_VALUES = {
+    piece: [
+        [sign * round(SCORE_SCALE * square_value(piece, row, col)) for col in range(8)]
+        for row in range(8)
+    ]
+    for color, sign in (("w", 1), ("b", -1))
+    for piece in (color + kind for kind in piece_value)
+}
+
+
 def find_random_move(valid_moves):
     """
     Selects a valid move randomly.
@@ -143,234 +186,926 @@ def find_greedy_move(game_state, valid_moves):
     return best_player_move
 
 
-def find_best_move_min_max(game_state, valid_moves):
+def weighted_score_board(game_state):
+    if game_state.checkmate:
+        if game_state.white_to_move:
+            return -CHECKMATE
+        else:
+            return CHECKMATE
+    elif game_state.stalemate:
+        return STALEMATE
+
+    if game_state.square_values is SQUARE_VALUES:
+        square_score = game_state.square_score
+    else:  # No running score to read, so add the values up
+        square_score = sum(
+            SQUARE_VALUES[game_state.board[row][col]][row][col]
+            for color in ("w", "b")
+            for row, col in game_state.piece_squares[color]
+        )
+
+    score = square_score / SCORE_SCALE
+
+    if VERIFY_EVALUATION and abs(score - scan_weighted_score(game_state)) > 1e-9:
+        raise RuntimeError("Running evaluation out of sync with the board")
+
+    return score
+
+
+def scan_weighted_score(game_state):
+    """
+    Scores the material and piece positions by going over every piece, the
+    slow way `weighted_score_board` is checked against.
+    """
+    score = 0
+
+    for color in ("w", "b"):
+        for row, col in game_state.piece_squares[color]:
+            square = game_state.board[row][col]
+            pos_score = 0
+
+            if square[1] == "p":
+                pos_score = piece_position_score[square][row][col]
+            elif square[1] == "N":
+                pos_score = piece_position_score[square[1]][row][col]
+            elif square[1] == "B":
+                pos_score = piece_position_score[square[1]][row][col]
+            elif square[1] == "R":
+                pos_score = piece_position_score[square[1]][row][col]
+            elif square[1] == "Q":
+                pos_score = piece_position_score[square[1]][row][col]
+            elif square[1] == "K":
+                pos_score = piece_position_score[square][row][col]
+
+            if square[0] == "w":
+                score += piece_value[square[1]] + pos_score * 0.5
+            elif square[0] == "b":
+                score -= piece_value[square[1]] + pos_score * 0.5
+
+    return score
+
+
+def score_board(game_state):
+    if game_state.checkmate:
+        if game_state.white_to_move:
+            return -CHECKMATE
+        else:
+            return CHECKMATE
+    elif game_state.stalemate:
+        return STALEMATE
+
+    score = 0
+
+    for row, col in game_state.piece_squares["w"]:
+        score += piece_value[game_state.board[row][col][1]]
+
+    for row, col in game_state.piece_squares["b"]:
+        score -= piece_value[game_state.board[row][col][1]]
+
+    return score
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search once its time or node budget is used up.
+    """
+
+
+class AlphaRaised(Exception):
+    """
+    Raised inside a worker's search once another worker has raised the
+    shared alpha above the one it searches with.
+    """
+
+
+class SearchContext:
+    """
+    What one search keeps track of: its budget, the killer moves of each ply,
+    the history table, and counters of the nodes and cutoffs.
+
+    The history table scores the quiet moves of each colour by `move_id`, so
+    from square and to square, and goes up by depth squared whenever a move
+    causes a cutoff.
+
+    In a worker of a parallel search, `shared_alpha` is the best root score
+    the workers have found so far, and `alpha` the one this search uses.
+    """
+
+    def __init__(self, root_length, deadline=None, node_limit=None, shared_alpha=None):
+        self.root_length = root_length
+        self.deadline = deadline
+        self.node_limit = node_limit
+        self.shared_alpha = shared_alpha
+        self.alpha = -CHECKMATE
+        self.killers = {}  # ply: [newest killer, older killer]
+        self.history = {"w": [0] * 4096, "b": [0] * 4096}
+        self.principal_variation = []
+        self.nodes = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    def count_node(self):
+        """
+        Counts a searched position, and raises `SearchTimeout` once the
+        budget is used up. Every `SHARED_ALPHA_INTERVAL` nodes, it also
+        raises `AlphaRaised` if the shared alpha went above `alpha`.
+        """
+        self.nodes += 1
+
+        if self.node_limit is not None and self.nodes > self.node_limit:
+            raise SearchTimeout
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchTimeout
+        if (
+            self.shared_alpha is not None
+            and self.nodes % SHARED_ALPHA_INTERVAL == 0
+            and self.shared_alpha.value > self.alpha
+        ):
+            raise AlphaRaised
+
+    @property
+    def first_move_cutoff_rate(self):
+        """
+        The share of cutoffs made by the first move searched at a node.
+        """
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    def get_killers(self, ply):
+        return self.killers.get(ply, ())
+
+    def history_score(self, move):
+        return self.history[move.piece_moved[0]][move.move_id]
+
+    def record_cutoff(self, move, depth, ply, first):
+        self.cutoffs += 1
+        self.first_move_cutoffs += first
+
+        if move.is_capture_move or move.is_pawn_promotion:
+            return
+
+        killers = self.killers.setdefault(ply, [None, None])
+
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+
+        self.history[move.piece_moved[0]][move.move_id] += depth * depth
+
+
+def has_non_pawn_material(game_state):
+    """
+    Checks whether the side to move has a piece other than its king and
+    pawns. Without one, having to move is often what loses (zugzwang), so
+    passing can't be taken as a sign that a position is good.
+    """
+    color = "w" if game_state.white_to_move else "b"
+
+    return any(
+        game_state.board[row][col][1] not in ("p", "K")
+        for row, col in game_state.piece_squares[color]
+    )
+
+
+def mvv_lva(move):
     """
-    Helper function for `find_recursive_minmax_move`
+    Orders captures by most valuable victim, then least valuable attacker.
+    A promotion counts as winning a queen.
     """
-    global next_move
-    next_move = None
+    score = 0
 
-    find_recursive_minmax_move(game_state, valid_moves, DEPTH, game_state.white_to_move)
+    if move.is_capture_move:
+        score += 10 * piece_value[move.piece_captured[1]]
+    if move.is_pawn_promotion:
+        score += 10 * piece_value["Q"]
 
-    return next_move
+    return score - piece_value[move.piece_moved[1]]
 
 
-def find_recursive_minmax_move(game_state, valid_moves, depth, white_to_move):
+def capture_gain(move):
+    """
+    How much a capture that isn't a promotion changes White's
+    `weighted_score_board` score by itself: the victim's square value, plus
+    the capturing piece's change of square.
     """
-    Finds best move with recursive MinMax algorithm.
+    victim_row = move.start_row if move.is_en_passant else move.end_row
+    moved = SQUARE_VALUES[move.piece_moved]
+    gain = (
+        moved[move.end_row][move.end_col]
+        - moved[move.start_row][move.start_col]
+        - SQUARE_VALUES[move.piece_captured][victim_row][move.end_col]
+    )
+
+    return gain / SCORE_SCALE
+
+
+class Searcher:
     """
-    global next_move
+    Searches for moves with its own depth, result, transposition table and
+    `SearchContext`, so each game can have its own searcher, and searches of
+    different games can run in separate threads or be interleaved without
+    getting in each other's way. One searcher runs one search at a time.
+
+    `best_move` is the result of the last search, while `next_move` is the
+    best root move of the search running.
 
-    if depth == 0:
-        return score_material(game_state.board)
+    `null_move_pruning` and `late_move_reductions` turn those parts of the
+    alpha-beta search on or off, to compare it with and without them.
+    """
+
+    def __init__(
+        self,
+        depth=DEPTH,
+        transposition_table_mb=TRANSPOSITION_TABLE_MB,
+        null_move_pruning=True,
+        late_move_reductions=True,
+    ):
+        self.depth = depth
+        self.transposition_table_mb = transposition_table_mb
+        self.null_move_pruning = null_move_pruning
+        self.late_move_reductions = late_move_reductions
+        self.best_move = None
+        self.next_move = None
+        self.transposition_table = TranspositionTable(transposition_table_mb)
+        self.context = SearchContext(0)
+
+    def find_best_move_min_max(self, game_state, valid_moves):
+        """
+        Helper function for `find_recursive_minmax_move`
+        """
+        self.next_move = None
+
+        self.find_recursive_minmax_move(
+            game_state, valid_moves, self.depth, game_state.white_to_move
+        )
+        self.best_move = self.next_move
+
+        return self.best_move
+
+    def find_recursive_minmax_move(self, game_state, valid_moves, depth, white_to_move):
+        """
+        Finds best move with recursive MinMax algorithm.
+        """
+        if depth == 0:
+            return score_material(game_state.board)
+
+        if white_to_move:
+            max_score = -CHECKMATE
+
+            for move in valid_moves:
+                game_state.make_move(move)
+
+                next_moves = game_state.get_valid_moves()
+                score = self.find_recursive_minmax_move(
+                    game_state, next_moves, depth - 1, False
+                )
+
+                if score > max_score:
+                    max_score = score
+
+                    if depth == self.depth:
+                        self.next_move = move
+
+                game_state.undo_move()
+
+            return max_score
+        else:
+            min_score = CHECKMATE
+
+            for move in valid_moves:
+                game_state.make_move(move)
+
+                next_moves = game_state.get_valid_moves()
+                score = self.find_recursive_minmax_move(
+                    game_state, next_moves, depth - 1, True
+                )
+
+                if score < min_score:
+
+                    min_score = score
+                    if depth == self.depth:
+                        self.next_move = move
+
+                game_state.undo_move()
+
+            return min_score
+
+    def find_move_nega_max(self, game_state, valid_moves, depth, turn):
+        """
+        Uses the NegaMax algorithm to find the best move at n depths.
+        """
+        if depth == 0:
+            return turn * score_board(game_state)
 
-    if white_to_move:
         max_score = -CHECKMATE
 
         for move in valid_moves:
             game_state.make_move(move)
 
             next_moves = game_state.get_valid_moves()
-            score = find_recursive_minmax_move(game_state, next_moves, depth - 1, False)
+            score = -self.find_move_nega_max(game_state, next_moves, depth - 1, -turn)
 
             if score > max_score:
                 max_score = score
 
-                if depth == DEPTH:
-                    next_move = move
+                if depth == self.depth:
+                    self.next_move = move
 
             game_state.undo_move()
 
         return max_score
-    else:
-        min_score = CHECKMATE
 
-        for move in valid_moves:
+    def find_best_move_nega_max(self, game_state, valid_moves):
+        """
+        Finds the best move from the NegaMax algorithm.
+        """
+        self.next_move = None
+        turn_mul = 1 if game_state.white_to_move else -1
+
+        r.shuffle(valid_moves)
+        self.find_move_nega_max(game_state, valid_moves, self.depth, turn_mul)
+        self.best_move = self.next_move
+
+        return self.best_move
+
+    def find_best_move_nega_max_alpha_beta(
+        self, game_state, valid_moves, time_limit=None, node_limit=None, max_depth=None
+    ):
+        """
+        Searches to depth 1, then 2, and so on up to `max_depth`, and returns
+        the best move of the deepest search that finished. Each search tries
+        the principal variation of the one before it first, within
+        `ASPIRATION_WINDOW` of its score. A score outside the window is only
+        a bound, so the search is repeated with the window widened on that
+        side, twice as far each time.
+
+        `time_limit` in seconds and `node_limit` stop the search early.
+        Without either, it goes to the searcher's depth, otherwise to
+        `MAX_DEPTH`. The depth 1 search always finishes, so there's always a
+        move. The search's `SearchContext` is left in `context`.
+
+        A game state without the `SQUARE_VALUES` table is given it first, so
+        the leaves read the running score rather than scan the board.
+        """
+        if game_state.square_values is not SQUARE_VALUES:
+            game_state.set_square_values(SQUARE_VALUES)
+
+        if max_depth is None:
+            if time_limit is None and node_limit is None:
+                max_depth = self.depth
+            else:
+                max_depth = MAX_DEPTH
+
+        turn_mul = 1 if game_state.white_to_move else -1
+        start = time.perf_counter()
+        root_length = len(game_state.move_log)
+        best_move = None
+        score = None
+        context = self.context = SearchContext(root_length)
+
+        r.shuffle(valid_moves)
+
+        for depth in range(1, max_depth + 1):
+            if depth > 1:
+                context.deadline = None if time_limit is None else start + time_limit
+                context.node_limit = node_limit
+
+            self.next_move = None
+            self.store_principal_variation(game_state, context.principal_variation)
+
+            if score is None:
+                alpha, beta = -CHECKMATE, CHECKMATE
+            else:
+                window = ASPIRATION_WINDOW
+                alpha = max(score - window, -CHECKMATE)
+                beta = min(score + window, CHECKMATE)
+
+            try:
+                while True:
+                    score = self.find_move_nega_max_alpha_beta(
+                        game_state, valid_moves, depth, alpha, beta, turn_mul
+                    )
+
+                    if score <= alpha and alpha > -CHECKMATE:
+                        window *= 2
+                        alpha = max(score - window, -CHECKMATE)
+                    elif score >= beta and beta < CHECKMATE:
+                        window *= 2
+                        beta = min(score + window, CHECKMATE)
+                    else:
+                        break
+            except SearchTimeout:
+                while len(game_state.move_log) > root_length:
+                    game_state.undo_move()
+
+                break
+
+            best_move = self.next_move
+            context.principal_variation = self.get_principal_variation(
+                game_state, depth
+            )
+
+            if abs(score) >= CHECKMATE:  # A forced mate, searching deeper won't help
+                break
+
+        self.best_move = best_move
+
+        return best_move
+
+    def find_best_move_parallel(
+        self, game_state, valid_moves, time_limit=None, max_depth=None, workers=None
+    ):
+        """
+        `find_best_move_nega_max_alpha_beta` with the root moves of each
+        search past depth 1 shared out over `workers` processes, all the
+        cores by default. The best move so far is searched first, on its own,
+        and then the rest all at once. The workers share the best root score
+        found so far through shared memory, and start each move's search
+        from it.
+
+        A worker gets the position as a snapshot plus the keys of the
+        positions since the last capture or pawn move, so it still sees
+        repetitions. Each worker process searches with a searcher of its own,
+        made with this one's pruning settings and table size. Only
+        `time_limit` stops the search early.
+        """
+        if max_depth is None:
+            max_depth = self.depth if time_limit is None else MAX_DEPTH
+
+        deadline = None if time_limit is None else time.time() + time_limit
+        best_move = self.find_best_move_nega_max_alpha_beta(
+            game_state, valid_moves, max_depth=1
+        )
+
+        if best_move is None:  # No moves, the game is over
+            return None
+
+        context = self.context
+        position = (
+            game_state.snapshot(),
+            game_state.key_history[-game_state.halfmove_clock - 1 :],
+        )
+        moves = {move.pack(): move for move in valid_moves}
+        scores = {}  # Packed move: its score in the last search that finished
+        alpha = multiprocessing.RawValue("d", -CHECKMATE)
+
+        with ProcessPoolExecutor(
+            workers,
+            initializer=_init_worker,
+            initargs=(
+                alpha,
+                self.null_move_pruning,
+                self.late_move_reductions,
+                self.transposition_table_mb,
+            ),
+        ) as executor:
+            for depth in range(2, max_depth + 1):
+                best_packed = best_move.pack()
+                order = sorted(
+                    moves,
+                    key=lambda packed: (
+                        packed == best_packed,
+                        scores.get(packed, -CHECKMATE),
+                    ),
+                    reverse=True,
+                )
+                alpha.value = -CHECKMATE
+                results = [
+                    executor.submit(
+                        _search_root_move, position, order[0], depth, deadline
+                    ).result()
+                ]
+
+                if results[0][1] is not None:
+                    futures = [
+                        executor.submit(
+                            _search_root_move, position, packed, depth, deadline
+                        )
+                        for packed in order[1:]
+                    ]
+                    results += [future.result() for future in futures]
+
+                context.nodes += sum(result[3] for result in results)
+
+                if any(result[1] is None for result in results):
+                    break
+
+                # A score at or below the alpha it was searched with is only an
+                # upper bound, so an exact score wins a tie
+                packed, score = max(results, key=lambda result: result[1:3])[:2]
+                best_move = moves[packed]
+                scores = {result[0]: result[1] for result in results}
+
+                if (
+                    abs(score) >= CHECKMATE
+                ):  # A forced mate, searching deeper won't help
+                    break
+
+        self.best_move = best_move
+
+        return best_move
+
+    def get_principal_variation(self, game_state, depth):
+        """
+        Follows the best moves kept in the transposition table from the
+        current position, for up to `depth` moves.
+        """
+        line = []
+
+        while len(line) < depth:
+            entry = self.transposition_table.probe(game_state.zobrist_key)
+
+            if entry is None or not entry[3]:
+                break
+
+            in_check, pins, checks = game_state.check_for_pins_and_checks()
+            move = game_state.find_legal_move(
+                Move.unpack(entry[3], game_state.board), pins, checks, in_check
+            )
+
+            if move is None:
+                break
+
+            line.append(move)
             game_state.make_move(move)
 
-            next_moves = game_state.get_valid_moves()
-            score = find_recursive_minmax_move(game_state, next_moves, depth - 1, True)
+            if game_state.is_repetition():
+                break
+
+        for move in line:
+            game_state.undo_move()
 
-            if score < min_score:
+        return line
 
-                min_score = score
-                if depth == DEPTH:
-                    next_move = move
+    def store_principal_variation(self, game_state, line):
+        """
+        Makes sure the table still holds each move of `line` for its
+        position, so the next search tries them first. A depth of 0 never
+        cuts a search.
+        """
+        for move in line:
+            entry = self.transposition_table.probe(game_state.zobrist_key)
 
+            if entry is None or entry[3] != move.pack():
+                self.transposition_table.store(
+                    game_state.zobrist_key, 0, 0.0, EXACT, move.pack()
+                )
+
+            game_state.make_move(move)
+
+        for move in line:
             game_state.undo_move()
 
-        return min_score
+    def find_move_nega_max_alpha_beta(
+        self, game_state, valid_moves, depth, alpha, beta, turn
+    ):
+        """
+        Below the root `valid_moves` is None and the moves come from
+        `get_staged_moves`, so a cutoff skips generating the remaining stages.
+
+        Only the first move gets the full window (principal variation
+        search). The rest are searched with a null window at alpha, which
+        only tells whether they beat it, and one that does is searched again
+        with the full window for its score.
+
+        Positions already searched deep enough are answered from the
+        transposition table. Otherwise the table's best move is tried first,
+        then captures by MVV-LVA, then the ply's killer moves, then the quiet
+        moves by their history score.
+
+        Both of the following only apply in null-window searches, off the
+        principal variation. With `null_move_pruning`, the side to move first
+        passes, and if a search `NULL_MOVE_REDUCTION` plies shallower still
+        can't bring the score under beta, the position counts as a cutoff.
+        It's left out when in check, right after a pass, and when the side
+        has only pawns left.
+
+        With `late_move_reductions`, quiet moves after the first
+        `LATE_MOVE_COUNT`, that don't give check, are searched a ply
+        shallower from `LATE_MOVE_DEPTH` up, and again in full only when
+        they beat alpha.
+        """
+        if depth == 0:
+            return self.quiescence_search(game_state, alpha, beta, turn)
+
+        context = self.context
+        context.count_node()
+        is_root = valid_moves is not None
+
+        key = game_state.zobrist_key
+        entry = self.transposition_table.probe(key)
+        hash_move = None
+        ply = len(game_state.move_log) - context.root_length
+
+        if entry is not None:
+            entry_depth, entry_score, bound, packed_move = entry
+
+            if packed_move:
+                hash_move = Move.unpack(packed_move, game_state.board)
+
+            if not is_root and entry_depth >= depth:
+                if bound == EXACT:
+                    return entry_score
+                if bound == LOWER_BOUND and entry_score >= beta:
+                    return entry_score
+                if bound == UPPER_BOUND and entry_score <= alpha:
+                    return entry_score
+
+        in_check = (
+            self.null_move_pruning or self.late_move_reductions
+        ) and game_state.in_check()
+        # Off the principal variation, allowing for rounding in the bounds
+        null_window = beta - alpha < 1.5 * NULL_WINDOW
+
+        if (
+            self.null_move_pruning
+            and not is_root
+            and null_window
+            and depth > NULL_MOVE_REDUCTION
+            and beta < CHECKMATE
+            and not in_check
+            and game_state.move_log[-1] is not None
+            and has_non_pawn_material(game_state)
+            and turn * weighted_score_board(game_state) >= beta
+        ):
+            game_state.make_null_move()
+            score = -self.find_move_nega_max_alpha_beta(
+                game_state,
+                None,
+                depth - 1 - NULL_MOVE_REDUCTION,
+                -beta,
+                -beta + NULL_WINDOW,
+                -turn,
+            )
+            game_state.undo_move()
 
+            if score >= beta:
+                return beta
 
-def weighted_score_board(game_state):
-    if game_state.checkmate:
-        if game_state.white_to_move:
-            return -CHECKMATE
+        if not is_root:
+            valid_moves = game_state.get_staged_moves(
+                hash_move, context.get_killers(ply), mvv_lva, context.history_score
+            )
         else:
-            return CHECKMATE
-    elif game_state.stalemate:
-        return STALEMATE
+            # The root keeps its shuffled order among moves that rank the same
+            valid_moves = sorted(
+                valid_moves,
+                key=lambda move: (
+                    move == hash_move,
+                    move.is_capture_move or move.is_pawn_promotion,
+                    mvv_lva(move),
+                    context.history_score(move),
+                ),
+                reverse=True,
+            )
+
+        original_alpha = alpha
+        max_score = -CHECKMATE
+        best_move = None
+        searched = 0
 
-    score = 0
+        for move in valid_moves:
+            searched += 1
+            game_state.make_move(move)
 
-    for row in range(len(game_state.board)):
-        for col in range(len(game_state.board[row])):
-            square = game_state.board[row][col]
+            if game_state.is_repetition() or game_state.fifty_move_rule:
+                score = STALEMATE  # A draw, no need to search any further
+            elif searched == 1:
+                score = -self.find_move_nega_max_alpha_beta(
+                    game_state, None, depth - 1, -beta, -alpha, -turn
+                )
+            else:
+                reduction = int(
+                    self.late_move_reductions
+                    and depth >= LATE_MOVE_DEPTH
+                    and searched > LATE_MOVE_COUNT
+                    and null_window
+                    and not in_check
+                    and not move.is_capture_move
+                    and not move.is_pawn_promotion
+                    and not game_state.in_check()
+                )
+                score = -self.find_move_nega_max_alpha_beta(
+                    game_state,
+                    None,
+                    depth - 1 - reduction,
+                    -alpha - NULL_WINDOW,
+                    -alpha,
+                    -turn,
+                )
+
+                if reduction and score > alpha:
+                    score = -self.find_move_nega_max_alpha_beta(
+                        game_state, None, depth - 1, -alpha - NULL_WINDOW, -alpha, -turn
+                    )
+
+                if alpha < score < beta:
+                    score = -self.find_move_nega_max_alpha_beta(
+                        game_state, None, depth - 1, -beta, -alpha, -turn
+                    )
+
+            if score > max_score or best_move is None:
+                max_score = score
+                best_move = move
 
-            if square != "--":
-                pos_score = 0
-
-                if square[1] == "p":
-                    pos_score = piece_position_score[square][row][col]
-                elif square[1] == "N":
-                    pos_score = piece_position_score[square[1]][row][col]
-                elif square[1] == "B":
-                    pos_score = piece_position_score[square[1]][row][col]
-                elif square[1] == "R":
-                    pos_score = piece_position_score[square[1]][row][col]
-                elif square[1] == "Q":
-                    pos_score = piece_position_score[square[1]][row][col]
-                elif square[1] == "K":
-                    pos_score = piece_position_score[square][row][col]
-
-                if square[0] == "w":
-                    score += piece_value[square[1]] + pos_score * 0.5
-                elif square[0] == "b":
-                    score -= piece_value[square[1]] + pos_score * 0.5
+                if is_root:
+                    self.next_move = move
 
-    return score
+            game_state.undo_move()
 
+            if max_score > alpha:
+                alpha = max_score
+            if alpha >= beta:
+                context.record_cutoff(move, depth, ply, searched == 1)
+                break
 
-def score_board(game_state):
-    if game_state.checkmate:
-        if game_state.white_to_move:
-            return -CHECKMATE
-        else:
-            return CHECKMATE
-    elif game_state.stalemate:
-        return STALEMATE
+        if best_move is None:  # Checkmate or stalemate, flagged once the moves ran out
+            return turn * weighted_score_board(game_state)
 
-    score = 0
+        if max_score <= original_alpha:
+            bound = UPPER_BOUND
+        elif max_score >= beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
 
-    for row in game_state.board:
-        for square in row:
-            if square[0] == "w":
-                score += piece_value[square[1]]
-            elif square[0] == "b":
-                score -= piece_value[square[1]]
+        self.transposition_table.store(key, depth, max_score, bound, best_move.pack())
 
-    return score
+        return max_score
 
+    def quiescence_search(self, game_state, alpha, beta, turn):
+        """
+        Carries on past the depth limit with captures and promotions only,
+        until the position is quiet, so the score isn't taken halfway through
+        an exchange. When in check, every move out of it is searched instead.
+
+        The side to move may also stand pat on the current score rather than
+        capture. A capture that leaves the score at or under alpha is skipped
+        (delta pruning), since the reply may stand pat on it, unless it gives
+        check. It still counts as worth that score, so a fail low returns a
+        bound over every skipped capture.
+        """
+        self.context.count_node()
+
+        if game_state.in_check():
+            max_score = -CHECKMATE
+            stand_pat = None
+            moves = game_state.get_staged_moves(capture_order=mvv_lva)
+        else:
+            max_score = stand_pat = turn * weighted_score_board(game_state)
 
-def find_move_nega_max(game_state, valid_moves, depth, turn):
-    """
-    Uses the NegaMax algorithm to find the best move at n depths.
-    """
+            if stand_pat >= beta:
+                return stand_pat
 
-    global next_move
+            alpha = max(alpha, stand_pat)
+            moves = game_state.get_capture_moves()
+            moves.sort(key=mvv_lva, reverse=True)
 
-    if depth == 0:
-        return turn * score_board(game_state)
+        for move in moves:
+            if stand_pat is not None and not move.is_pawn_promotion:
+                bound = stand_pat + turn * capture_gain(move)
 
-    max_score = -CHECKMATE
+                if bound <= alpha and not game_state.gives_check(move):
+                    max_score = max(max_score, bound)
+                    continue
 
-    for move in valid_moves:
-        game_state.make_move(move)
+            game_state.make_move(move)
+            score = -self.quiescence_search(game_state, -beta, -alpha, -turn)
+            game_state.undo_move()
 
-        next_moves = game_state.get_valid_moves()
-        score = -find_move_nega_max(game_state, next_moves, depth - 1, -turn)
+            if score > max_score:
+                max_score = score
 
-        if score > max_score:
-            max_score = score
+            if max_score > alpha:
+                alpha = max_score
+            if alpha >= beta:
+                break
 
-            if depth == DEPTH:
-                next_move = move
+        return max_score
 
-        game_state.undo_move()
 
-    return max_score
+def find_best_move_min_max(game_state, valid_moves):
+    """
+    `Searcher.find_best_move_min_max` with the module's `searcher`.
+    """
+    return searcher.find_best_move_min_max(game_state, valid_moves)
 
 
 def find_best_move_nega_max(game_state, valid_moves):
     """
-    Finds the best move from the NegaMax algorithm.
+    `Searcher.find_best_move_nega_max` with the module's `searcher`.
     """
+    return searcher.find_best_move_nega_max(game_state, valid_moves)
 
-    global next_move
-
-    next_move = None
-    turn_mul = 1 if game_state.white_to_move else -1
-
-    r.shuffle(valid_moves)
-    find_move_nega_max(game_state, valid_moves, DEPTH, turn_mul)
-
-    return next_move
 
+def find_best_move_nega_max_alpha_beta(
+    game_state, valid_moves, time_limit=None, node_limit=None, max_depth=None
+):
+    """
+    `Searcher.find_best_move_nega_max_alpha_beta` with the module's
+    `searcher`. Its `SearchContext` is then left in `search_context`.
+    """
+    global search_context
 
-def find_best_move_nega_max_alpha_beta(game_state, valid_moves):
-    global next_move
+    best_move = searcher.find_best_move_nega_max_alpha_beta(
+        game_state, valid_moves, time_limit, node_limit, max_depth
+    )
+    search_context = searcher.context
 
-    next_move = None
-    turn_mul = 1 if game_state.white_to_move else -1
+    return best_move
 
-    r.shuffle(valid_moves)
 
-    temp_castling_rights = game_state.castling_rights.copy()
+def find_best_move_parallel(
+    game_state, valid_moves, time_limit=None, max_depth=None, workers=None
+):
+    """
+    `Searcher.find_best_move_parallel` with the module's `searcher`. Its
+    `SearchContext` is then left in `search_context`.
+    """
+    global search_context
 
-    find_move_nega_max_alpha_beta(
-        game_state,
-        valid_moves,
-        DEPTH,
-        -CHECKMATE,
-        CHECKMATE,
-        turn_mul,
-        temp_castling_rights,
+    best_move = searcher.find_best_move_parallel(
+        game_state, valid_moves, time_limit, max_depth, workers
     )
+    search_context = searcher.context
 
-    return next_move
+    return best_move
 
 
-def find_move_nega_max_alpha_beta(
-    game_state, valid_moves, depth, alpha, beta, turn, temp_castling_rights
+def _init_worker(
+    alpha, null_move_pruning, late_move_reductions, transposition_table_mb
 ):
-    global next_move
+    """
+    Sets up a worker process of `find_best_move_parallel`: the shared alpha,
+    and a searcher with the settings of the one searching in parallel.
+    """
+    global shared_alpha, worker_searcher
 
-    if depth == 0:
-        return turn * weighted_score_board(game_state)
+    shared_alpha = alpha
+    worker_searcher = Searcher(
+        transposition_table_mb=transposition_table_mb,
+        null_move_pruning=null_move_pruning,
+        late_move_reductions=late_move_reductions,
+    )
 
-    max_score = -CHECKMATE
 
-    for move in valid_moves:
-        game_state.make_move(move)
+def _search_root_move(position, packed_move, depth, deadline):
+    """
+    Searches one root move in a worker of `find_best_move_parallel`. Returns
+    the packed move, its score, whether the score is exact, and the nodes
+    searched. The score is None when the time ran out.
 
-        saved_castling_rights = game_state.castling_rights.copy()
+    Whenever another worker raises the shared alpha meanwhile, the search
+    starts over with the narrower window. What it searched already is still
+    in the transposition table.
+    """
+    snapshot, key_history = position
+    game_state = GameState(square_values=SQUARE_VALUES)
+    game_state.restore(snapshot)
+    game_state.key_history = list(key_history)
+    game_state.position_counts = {}
+
+    for key in key_history:
+        game_state.position_counts[key] = game_state.position_counts.get(key, 0) + 1
+
+    game_state.update_draw_flags()
+    in_check, pins, checks = game_state.check_for_pins_and_checks()
+    move = game_state.find_legal_move(
+        Move.unpack(packed_move, game_state.board), pins, checks, in_check
+    )
+    turn = 1 if game_state.white_to_move else -1
 
-        game_state.update_castling_rights(move)
+    if deadline is not None:  # From the wall clock to this process's clock
+        deadline += time.perf_counter() - time.time()
 
-        next_moves = game_state.get_valid_moves()
-        score = -find_move_nega_max_alpha_beta(
-            game_state,
-            next_moves,
-            depth - 1,
-            -beta,
-            -alpha,
-            -turn,
-            temp_castling_rights,
-        )
+    context = worker_searcher.context = SearchContext(0, deadline, None, shared_alpha)
+    game_state.make_move(move)
 
-        if score > max_score:
-            max_score = score
+    while True:
+        alpha = context.alpha = shared_alpha.value
 
-            if depth == DEPTH:
-                next_move = move
+        try:
+            if game_state.is_repetition() or game_state.fifty_move_rule:
+                score = STALEMATE
+            else:
+                score = -worker_searcher.find_move_nega_max_alpha_beta(
+                    game_state, None, depth - 1, -CHECKMATE, -alpha, -turn
+                )
 
-        game_state.undo_move()
+            break
+        except AlphaRaised:
+            while len(game_state.move_log) > 1:
+                game_state.undo_move()
+        except SearchTimeout:
+            return packed_move, None, False, context.nodes
 
-        game_state.castling_rights = saved_castling_rights
+    if score > shared_alpha.value:  # A lost race only widens another's window
+        shared_alpha.value = score
+
+    return packed_move, score, score > alpha, context.nodes
 
-        if max_score > alpha:
-            alpha = max_score
-        if alpha >= beta:
-            break
 
-    return max_score
+searcher = Searcher()  # Searches for the module-level find_best_move functions
+transposition_table = searcher.transposition_table
+search_context = searcher.context
+shared_alpha = None  # The best root score so far, in a parallel search's workers
+worker_searcher = None  # The searcher of a parallel search's worker process
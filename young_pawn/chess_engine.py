@@ -1,80 +1,43 @@
-from copy import deepcopy
-
-
-class EmptyLinkedList(ValueError):
-    pass
-
-
-class _DoubleLinkedList:
-    class _Node:
-        __slots__ = "_element", "_next", "_prev"
-
-        def __init__(self, element, next, prev):
-            self._element = element
-            self._next = next
-            self._prev = prev
-
-    def __init__(self):
-        self._head = None
-        self._tail = None
-        self._size = 0
-
-    def __len__(self):
-        return self._size
-
-    def is_empty(self):
-        return self._size == 0
-
-    def enqueue(self, element):
-        node = _DoubleLinkedList._Node(element, None, None)
-
-        if self.is_empty():
-            self._head = (
-                node  # When the list is empty, set head and tail to the same node
-            )
-        else:
-            self._tail._next = node  # Link the current tail to the new node
-            node._prev = self._tail  # Link the new node back to the previous tail
-
-        self._tail = node
-
-        self._size += 1
-
-    def dequeue(self):
-        if self.is_empty():
-            raise EmptyLinkedList("Empty linked list")
-
-        node_element = self._head._element
-        self._head = self._head._next
-
-        if self._head:
-            self._head._prev = None
-
-        self._size -= 1
-
-        if self.is_empty():
-            self._tail = None
-
-        return node_element
-
-    def append(self, element):
-        self.enqueue(element)
-
-    def pop(self):
-        if self.is_empty():
-            raise EmptyLinkedList("Empty linked list")
-
-        node_element = self._tail._element
-        self._tail = self._tail._prev
-
-        if self._tail:
-            self._tail._next = None
-        else:
-            self._head = None
-
-        self._size -= 1
-
-        return node_element
+import struct
+from collections import OrderedDict
+
+import zobrist
+from move_tables import (
+    BISHOP_RAYS,
+    KING_MOVES,
+    KNIGHT_MOVES,
+    PAWN_CAPTURES,
+    PAWN_PUSHES,
+    QUEEN_RAYS,
+    ROOK_RAYS,
+)
+
+
+# Castling rights lost when a piece leaves or lands on one of these squares
+CASTLING_SQUARES = {
+    (7, 4): ("w_kingside", "w_queenside"),
+    (7, 7): ("w_kingside",),
+    (7, 0): ("w_queenside",),
+    (0, 4): ("b_kingside", "b_queenside"),
+    (0, 7): ("b_kingside",),
+    (0, 0): ("b_queenside",),
+}
+# A snapshot packs the board as one byte per square, then the side to move and
+# castling bits, the en passant square (64 for none), the halfmove clock, the
+# fullmove number and the Zobrist key
+SNAPSHOT_FORMAT = struct.Struct("<64sBBHHQ")
+PIECE_CODES = {
+    piece: code
+    for code, piece in enumerate(
+        ("--", "wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+    )
+}
+PIECE_NAMES = tuple(PIECE_CODES)
+# Estimated memory of a move cache entry, measured with tracemalloc: the key,
+# its slots in the ordered dict and the entry and move tuples, plus each move
+# with its move_id and its slot in the tuple
+MOVE_CACHE_ENTRY_BYTES = 320
+MOVE_CACHE_MOVE_BYTES = 150
 
 
 class GameState:
@@ -84,13 +47,33 @@ class GameState:
     moves at the current state. It will also keep a move log.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        verify_hash=False,
+        move_cache_mb=0,
+        square_values=None,
+    ):
         """
         Board is an 8-by-8 2D list, each element of the list has 2 characters
         The first character represents the colour of the piece, 'b' or 'w',
         and the second character represents the type of piece, 'p', 'N', 'B',
         'R', 'Q', and 'K'.
         The string '--' represents an empty square.
+
+        `zobrist_key` identifies the position and is updated move by move.
+        With `verify_hash`, every move and undo checks it against a key
+        computed from scratch, which is slow and only meant for debugging.
+
+        `key_history` stacks the keys of the positions so far, and
+        `position_counts` counts them, so `threefold_repetition` and
+        `fifty_move_rule` are kept up to date in constant time per move.
+
+        With a `move_cache_mb`, `get_valid_moves` remembers the moves of the
+        positions it was last asked about, in about that many megabytes.
+
+        `square_score` sums a value per piece and square, from the
+        `square_values` table, square_values[piece][row][col], and is
+        updated move by move too. Without a table it stays 0.
         """
         self.pieces = ["R", "N", "B", "Q", "K", "B", "N", "R"]
         self.board = [
@@ -117,32 +100,357 @@ class GameState:
         self.black_king_location = (0, 4)
         self.checkmate = False
         self.stalemate = False
+        self.threefold_repetition = False
+        self.fifty_move_rule = False
         self.en_passant_possible = ()  # Initialize here
-        self.en_passant_possible_log = [self.en_passant_possible]
+        self.pins = {}  # Filled in by `get_legal_moves` for the generators
         self.castling_rights = Castling(True, True, True, True)
-        self.castling_log = [
-            Castling(
-                self.castling_rights.w_kingside,
-                self.castling_rights.w_queenside,
-                self.castling_rights.b_kingside,
-                self.castling_rights.b_queenside,
+        # One record per move in `move_log`, holding what the move overwrites:
+        # (en passant square, castling rights, white king, black king, key,
+        # halfmove clock, square score)
+        self.undo_log = []
+        # The squares holding each side's pieces, kept up to date move by move
+        self.piece_squares = {"w": set(), "b": set()}
+        self.zobrist_key = 0
+        self.verify_hash = verify_hash
+        self.halfmove_clock = 0  # Moves since the last capture or pawn move
+        self.fullmove_number = 1  # Goes up after each black move
+        self.key_history = []  # The current position's key is the last one
+        self.position_counts = {}
+        self.move_cache = MoveCache(move_cache_mb) if move_cache_mb else None
+        self.square_values = square_values
+        self.square_score = 0
+
+        self._index_pieces()
+
+    @classmethod
+    def from_fen(cls, fen, verify_hash=False, square_values=None):
+        """
+        Sets up a position from a FEN string: pieces, side to move, castling
+        rights, en passant square and the halfmove and fullmove counters,
+        which may be left out. The game history starts at this position.
+        """
+        fields = fen.split()
+        ranks = fields[0].split("/") if fields else []
+
+        if len(fields) < 4 or len(ranks) != 8 or fields[1] not in ("w", "b"):
+            raise ValueError(f"Invalid FEN: {fen!r}")
+        if fields[2] != "-" and not set(fields[2]) <= set("KQkq"):
+            raise ValueError(f"Invalid FEN: {fen!r}")
+        if fields[3] != "-" and (
+            len(fields[3]) != 2
+            or fields[3][0] not in Move.FILES_TO_COLS
+            or fields[3][1] not in ("3", "6")
+        ):
+            raise ValueError(f"Invalid FEN: {fen!r}")
+
+        game_state = cls(
+            verify_hash=verify_hash,
+            square_values=square_values,
+        )
+        board = []
+
+        for rank in ranks:
+            row = []
+
+            for char in rank:
+                if char.isdigit():
+                    row.extend(["--"] * int(char))
+                elif char in "pnbrqkPNBRQK":
+                    color = "w" if char.isupper() else "b"
+                    row.append(color + ("p" if char in "pP" else char.upper()))
+                else:
+                    raise ValueError(f"Invalid FEN: {fen!r}")
+
+            if len(row) != 8:
+                raise ValueError(f"Invalid FEN: {fen!r}")
+
+            board.append(row)
+
+        pieces = [piece for row in board for piece in row]
+
+        if pieces.count("wK") != 1 or pieces.count("bK") != 1:
+            raise ValueError(f"Invalid FEN, each side needs one king: {fen!r}")
+
+        game_state.board = board
+        game_state.white_to_move = fields[1] == "w"
+        game_state.castling_rights = Castling(
+            "K" in fields[2], "Q" in fields[2], "k" in fields[2], "q" in fields[2]
+        )
+
+        if len(fields) > 4:
+            game_state.halfmove_clock = int(fields[4])
+        if len(fields) > 5:
+            game_state.fullmove_number = int(fields[5])
+
+        for row in range(8):
+            for col in range(8):
+                if board[row][col] == "wK":
+                    game_state.white_king_location = (row, col)
+                elif board[row][col] == "bK":
+                    game_state.black_king_location = (row, col)
+
+        if fields[3] != "-":
+            en_passant = (
+                Move.RANKS_TO_ROWS[fields[3][1]],
+                Move.FILES_TO_COLS[fields[3][0]],
             )
+
+            # Kept only when a pawn can take there, as after `make_move`
+            if game_state.can_capture_en_passant(en_passant):
+                game_state.en_passant_possible = en_passant
+
+        game_state._index_pieces()
+
+        return game_state
+
+    def to_fen(self):
+        """
+        Writes the position as a FEN string.
+        """
+        ranks = []
+
+        for row in self.board:
+            rank, empty = "", 0
+
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+
+                if empty:
+                    rank, empty = rank + str(empty), 0
+
+                char = piece[1].upper()
+                rank += char if piece[0] == "w" else char.lower()
+
+            ranks.append(rank + (str(empty) if empty else ""))
+
+        rights = self.castling_rights
+        castling = "".join(
+            char
+            for char, right in zip(
+                "KQkq",
+                (
+                    rights.w_kingside,
+                    rights.w_queenside,
+                    rights.b_kingside,
+                    rights.b_queenside,
+                ),
+            )
+            if right
+        )
+        en_passant = "-"
+
+        if self.en_passant_possible:
+            row, col = self.en_passant_possible
+            en_passant = Move.COLS_TO_FILES[col] + Move.ROWS_TO_RANKS[row]
+
+        return " ".join(
+            (
+                "/".join(ranks),
+                "w" if self.white_to_move else "b",
+                castling or "-",
+                en_passant,
+                str(self.halfmove_clock),
+                str(self.fullmove_number),
+            )
+        )
+
+    def snapshot(self):
+        """
+        Packs the position -- but not the game history -- into a bytes object
+        of `SNAPSHOT_FORMAT`, cheap to keep, compare or send to a process.
+        """
+        rights = self.castling_rights
+        flags = (
+            self.white_to_move
+            | rights.w_kingside << 1
+            | rights.w_queenside << 2
+            | rights.b_kingside << 3
+            | rights.b_queenside << 4
+        )
+        en_passant = 64
+
+        if self.en_passant_possible:
+            en_passant = self.en_passant_possible[0] * 8 + self.en_passant_possible[1]
+
+        return SNAPSHOT_FORMAT.pack(
+            bytes([PIECE_CODES[piece] for row in self.board for piece in row]),
+            flags,
+            en_passant,
+            self.halfmove_clock,
+            self.fullmove_number,
+            self.zobrist_key,
+        )
+
+    def restore(self, snapshot):
+        """
+        Sets up the position packed by `snapshot`. The game history starts
+        over from it, so moves made before can't be undone any more.
+        """
+        squares, flags, en_passant, halfmove_clock, fullmove_number, key = (
+            SNAPSHOT_FORMAT.unpack(snapshot)
+        )
+        self.board = [
+            [PIECE_NAMES[code] for code in squares[row * 8 : row * 8 + 8]]
+            for row in range(8)
         ]
-        self.board_states = _DoubleLinkedList()
-        self.castling_states = _DoubleLinkedList()
+        self.white_to_move = bool(flags & 1)
+        self.castling_rights = Castling(
+            bool(flags & 2), bool(flags & 4), bool(flags & 8), bool(flags & 16)
+        )
+        self.en_passant_possible = (
+            (en_passant >> 3, en_passant & 7) if en_passant < 64 else ()
+        )
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+        self.move_log = []
+        self.undo_log = []
+        self.checkmate = False
+        self.stalemate = False
+        self.white_king_location = divmod(squares.index(PIECE_CODES["wK"]), 8)
+        self.black_king_location = divmod(squares.index(PIECE_CODES["bK"]), 8)
+
+        self._index_pieces(key)
+
+    def clone(self, history=False):
+        """
+        Copies the game through a snapshot. The copy only starts from the
+        current position, unless `history` also copies the moves that lead
+        to it, so they can be undone on the copy.
+        """
+        game_state = GameState(
+            self.verify_hash,
+            self.move_cache.size_mb if self.move_cache else 0,
+            self.square_values,
+        )
+        game_state.restore(self.snapshot())
+
+        if history:
+            game_state.move_log = self.move_log.copy()
+            game_state.undo_log = self.undo_log.copy()
+            game_state.key_history = self.key_history.copy()
+            game_state.position_counts = self.position_counts.copy()
+            game_state.update_draw_flags()
+
+        return game_state
+
+    def _index_pieces(self, zobrist_key=None):
+        """
+        Rebuilds the piece squares, the square score and the Zobrist key from
+        the board, unless the key is given. The position history starts over
+        from this position.
+        """
+        for squares in self.piece_squares.values():
+            squares.clear()
+
+        for row in range(8):
+            for col in range(8):
+                if self.board[row][col] != "--":
+                    self.piece_squares[self.board[row][col][0]].add((row, col))
+
+        self.square_score = self.scan_square_score()
+
+        if zobrist_key is None:
+            zobrist_key = zobrist.hash_position(self)
+
+        self.zobrist_key = zobrist_key
+        self.key_history = [zobrist_key]
+        self.position_counts = {self.zobrist_key: 1}
+
+        self.update_draw_flags()
+
+    def set_square_values(self, square_values):
+        """
+        Changes the `square_values` table, or sets it to None to stop keeping
+        the score. The moves made so far are taken back and made again, so
+        undoing them restores the right scores, which takes time in a long
+        game. Passing the table to the constructor avoids that.
+        """
+        moves = self.move_log.copy()
+        game_over = self.checkmate, self.stalemate
+
+        for move in moves:
+            self.undo_move()
+
+        self.square_values = square_values
+        self.square_score = self.scan_square_score()
+
+        for move in moves:
+            if move is None:  # A pass from `make_null_move`
+                self.make_null_move()
+            else:
+                self.make_move(move)
+
+        self.checkmate, self.stalemate = game_over
+
+    def scan_square_score(self):
+        """
+        Computes `square_score` from scratch.
+        """
+        if self.square_values is None:
+            return 0
+
+        return sum(
+            self.square_values[self.board[row][col]][row][col]
+            for color in ("w", "b")
+            for row, col in self.piece_squares[color]
+        )
 
-        # Save initial states
-        self.board_states.append(deepcopy(self.board))
-        self.castling_states.append(deepcopy(self.castling_rights))
+    def update_draw_flags(self):
+        self.threefold_repetition = self.position_counts[self.zobrist_key] >= 3
+        self.fifty_move_rule = self.halfmove_clock >= 100
+
+    def is_repetition(self):
+        """
+        Checks whether the current position has appeared before in the game.
+        """
+        return self.position_counts[self.zobrist_key] > 1
+
+    def check_hash(self):
+        """
+        Raises an error when the incremental Zobrist key doesn't match the one
+        computed from scratch.
+        """
+        if self.zobrist_key != zobrist.hash_position(self):
+            raise RuntimeError("Zobrist key out of sync with the position")
 
     def make_move(self, move):
-        self.board_states.enqueue(deepcopy(self.board))
-        self.castling_states.enqueue(deepcopy(self.castling_rights))
+        castling_rights = self.castling_rights
+        self.save_undo_record()
+        piece_keys = zobrist.PIECE_KEYS
+        key = (
+            self.zobrist_key
+            ^ zobrist.BLACK_TO_MOVE
+            ^ piece_keys[move.piece_moved][move.start_row][move.start_col]
+        )
         self.board[move.start_row][move.start_col] = "--"
         self.board[move.end_row][move.end_col] = move.piece_moved
         self.move_log.append(move)
         self.white_to_move = not self.white_to_move
 
+        if self.white_to_move:
+            ally_squares, enemy_squares = (
+                self.piece_squares["b"],
+                self.piece_squares["w"],
+            )
+        else:
+            ally_squares, enemy_squares = (
+                self.piece_squares["w"],
+                self.piece_squares["b"],
+            )
+
+        ally_squares.remove((move.start_row, move.start_col))
+        ally_squares.add((move.end_row, move.end_col))
+
+        if move.is_en_passant:
+            enemy_squares.remove((move.start_row, move.end_col))
+            key ^= piece_keys[move.piece_captured][move.start_row][move.end_col]
+        elif move.piece_captured != "--":
+            enemy_squares.remove((move.end_row, move.end_col))
+            key ^= piece_keys[move.piece_captured][move.end_row][move.end_col]
+
         if move.piece_moved == "wK":
             self.white_king_location = (move.end_row, move.end_col)
         elif move.piece_moved == "bK":
@@ -154,172 +462,539 @@ class GameState:
         if move.is_en_passant:
             self.board[move.start_row][move.end_col] = "--"
 
+        placed = self.board[move.end_row][move.end_col]
+        key ^= piece_keys[placed][move.end_row][move.end_col]
+
+        if self.en_passant_possible:
+            key ^= zobrist.EN_PASSANT_KEYS[self.en_passant_possible[1]]
+
+        self.en_passant_possible = ()
+
         if move.piece_moved[-1] == "p" and abs(move.start_row - move.end_row) == 2:
-            self.en_passant_possible = (
-                (move.start_row + move.end_row) // 2,
-                move.start_col,
-            )
-        else:
-            self.en_passant_possible = ()
+            en_passant = ((move.start_row + move.end_row) // 2, move.start_col)
+
+            if self.can_capture_en_passant(en_passant):
+                self.en_passant_possible = en_passant
+                key ^= zobrist.EN_PASSANT_KEYS[move.start_col]
 
         if move.castling:
             if move.end_col - move.start_col == 2:  # Kingside castling
-                self.board[move.end_row][move.end_col - 1] = self.board[move.end_row][
-                    move.end_col + 1
-                ]
-                self.board[move.end_row][move.end_col + 1] = "--"
+                rook_start, rook_end = move.end_col + 1, move.end_col - 1
             else:  # Queenside castling
-                self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][
-                    move.end_col - 2
-                ]
-                self.board[move.end_row][move.end_col - 2] = "--"
+                rook_start, rook_end = move.end_col - 2, move.end_col + 1
+
+            self.board[move.end_row][rook_end] = self.board[move.end_row][rook_start]
+            self.board[move.end_row][rook_start] = "--"
+            ally_squares.remove((move.end_row, rook_start))
+            ally_squares.add((move.end_row, rook_end))
+            rook_keys = piece_keys[move.piece_moved[0] + "R"][move.end_row]
+            key ^= rook_keys[rook_start] ^ rook_keys[rook_end]
+
+        if self.square_values is not None:
+            self.update_square_score(move, placed)
 
-        self.en_passant_possible_log.append(self.en_passant_possible)
         self.update_castling_rights(move)
-        self.castling_log.append(
-            Castling(
-                self.castling_rights.w_kingside,
-                self.castling_rights.w_queenside,
-                self.castling_rights.b_kingside,
-                self.castling_rights.b_queenside,
+
+        if self.castling_rights is not castling_rights:
+            key ^= zobrist.castling_key(castling_rights)
+            key ^= zobrist.castling_key(self.castling_rights)
+
+        self.zobrist_key = key
+        self.key_history.append(key)
+        self.position_counts[key] = self.position_counts.get(key, 0) + 1
+
+        if move.piece_moved[1] == "p" or move.piece_captured != "--":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+
+        if self.white_to_move:
+            self.fullmove_number += 1
+
+        self.update_draw_flags()
+
+        if self.verify_hash:
+            self.check_hash()
+
+    def can_capture_en_passant(self, square):
+        """
+        Checks whether a pawn of the side to move can legally take en passant
+        on `square`, the square an enemy pawn skipped with its double push.
+        The en passant square is only set, and only in the Zobrist key, when
+        one can, so positions that differ by nothing else are the same for
+        repetitions.
+        """
+        row, col = square
+
+        if self.white_to_move:
+            pawn, enemy_pawn, start_row = "wp", "bp", row + 1
+        else:
+            pawn, enemy_pawn, start_row = "bp", "wp", row - 1
+
+        board = self.board
+
+        if board[row][col] != "--" or board[start_row][col] != enemy_pawn:
+            return False
+
+        for start_col in (col - 1, col + 1):
+            if not 0 <= start_col < 8 or board[start_row][start_col] != pawn:
+                continue
+
+            # Taking en passant empties two squares of the same row, which may
+            # uncover an attack on the king
+            board[start_row][start_col] = board[start_row][col] = "--"
+            board[row][col] = pawn
+            legal = not self.in_check()
+            board[row][col] = "--"
+            board[start_row][start_col] = pawn
+            board[start_row][col] = enemy_pawn
+
+            if legal:
+                return True
+
+        return False
+
+    def make_null_move(self):
+        """
+        Passes the turn to the other side without moving a piece, which only
+        clears the en passant square, for the search's null-move pruning. It
+        goes in `move_log` as None and `undo_move` takes it back. Not for a
+        side in check.
+        """
+        self.save_undo_record()
+        key = self.zobrist_key ^ zobrist.BLACK_TO_MOVE
+
+        if self.en_passant_possible:
+            key ^= zobrist.EN_PASSANT_KEYS[self.en_passant_possible[1]]
+            self.en_passant_possible = ()
+
+        self.move_log.append(None)
+        self.white_to_move = not self.white_to_move
+        self.zobrist_key = key
+        self.key_history.append(key)
+        self.position_counts[key] = self.position_counts.get(key, 0) + 1
+
+        self.update_draw_flags()
+
+        if self.verify_hash:
+            self.check_hash()
+
+    def save_undo_record(self):
+        self.undo_log.append(
+            (
+                self.en_passant_possible,
+                self.castling_rights,
+                self.white_king_location,
+                self.black_king_location,
+                self.zobrist_key,
+                self.halfmove_clock,
+                self.square_score,
             )
         )
 
     def undo_move(self):
         if len(self.move_log) != 0:
             move = self.move_log.pop()
+            key = self.key_history.pop()
+
+            if self.position_counts[key] == 1:
+                del self.position_counts[key]
+            else:
+                self.position_counts[key] -= 1
+
+            (
+                self.en_passant_possible,
+                self.castling_rights,
+                self.white_king_location,
+                self.black_king_location,
+                self.zobrist_key,
+                self.halfmove_clock,
+                self.square_score,
+            ) = self.undo_log.pop()
+
+            if move is None:  # A pass from `make_null_move`
+                self.white_to_move = not self.white_to_move
+                self.checkmate, self.stalemate = False, False
+
+                self.update_draw_flags()
+
+                if self.verify_hash:
+                    self.check_hash()
+
+                return
 
-            # Restore the rest of the board and game state
             self.board[move.start_row][move.start_col] = move.piece_moved
             self.board[move.end_row][move.end_col] = move.piece_captured
             self.white_to_move = not self.white_to_move
 
-            if move.piece_moved == "wK":
-                self.white_king_location = (move.start_row, move.start_col)
-            elif move.piece_moved == "bK":
-                self.black_king_location = (move.start_row, move.start_col)
+            if self.white_to_move:
+                ally_squares = self.piece_squares["w"]
+                enemy_squares = self.piece_squares["b"]
+            else:
+                ally_squares = self.piece_squares["b"]
+                enemy_squares = self.piece_squares["w"]
+                self.fullmove_number -= 1
+
+            ally_squares.remove((move.end_row, move.end_col))
+            ally_squares.add((move.start_row, move.start_col))
 
             if move.is_en_passant:
                 self.board[move.end_row][move.end_col] = "--"
                 self.board[move.start_row][move.end_col] = move.piece_captured
+                enemy_squares.add((move.start_row, move.end_col))
+            elif move.piece_captured != "--":
+                enemy_squares.add((move.end_row, move.end_col))
 
-            self.en_passant_possible_log.pop()
-
-            self.en_passant_possible = self.en_passant_possible_log[-1]
-
-            # Apply castling back if necessary (this will be done only after restoring the state)
             if move.castling:
-                if move.piece_moved == "wK":
-                    if move.end_col - move.start_col == 2:
-                        self.board[move.start_row][7] = "wR"
-                        self.board[move.start_row][5] = "--"
-                        self.castling_rights.w_kingside = True
-                    elif move.end_col - move.start_col == -2:
-                        self.board[move.start_row][0] = "wR"
-                        self.board[move.start_row][3] = "--"
-                        self.castling_rights.w_queenside = True
-                elif move.piece_moved == "bK":
-                    if move.end_col - move.start_col == 2:
-                        self.board[move.start_row][7] = "bR"
-                        self.board[move.start_row][5] = "--"
-                        self.castling_rights.b_kingside = True
-                    elif move.end_col - move.start_col == -2:
-                        self.board[move.start_row][0] = "bR"
-                        self.board[move.start_row][3] = "--"
-                        self.castling_rights.b_queenside = True
-
-            if not self.board_states.is_empty():
-                self.board = self.board_states.pop()  # Restore the board
-            if not self.castling_states.is_empty():
-                self.castling_rights = (
-                    self.castling_states.pop()
-                )  # Restore castling rights
-
-            if move.piece_moved in ["wR", "bR"]:
-                if move.start_row == 7 and move.start_col == 0:  # White queenside rook
-                    self.castling_rights.w_queenside = True
-                elif move.start_row == 7 and move.start_col == 7:  # White kingside rook
-                    self.castling_rights.w_kingside = True
-                elif (
-                    move.start_row == 0 and move.start_col == 0
-                ):  # Black queenside rook
-                    self.castling_rights.b_queenside = True
-                elif move.start_row == 0 and move.start_col == 7:  # Black kingside rook
-                    self.castling_rights.b_kingside = True
+                if move.end_col - move.start_col == 2:  # Kingside castling
+                    rook_start, rook_end = move.end_col + 1, move.end_col - 1
+                else:  # Queenside castling
+                    rook_start, rook_end = move.end_col - 2, move.end_col + 1
+
+                self.board[move.end_row][rook_start] = self.board[move.end_row][
+                    rook_end
+                ]
+                self.board[move.end_row][rook_end] = "--"
+                ally_squares.remove((move.end_row, rook_end))
+                ally_squares.add((move.end_row, rook_start))
 
             self.checkmate, self.stalemate = False, False
 
+            self.update_draw_flags()
+
+            if self.verify_hash:
+                self.check_hash()
+
+    def update_square_score(self, move, placed):
+        """
+        Adds the change `move` makes to `square_score`, with `placed` the
+        piece it leaves on its end square.
+        """
+        values = self.square_values
+        score = (
+            self.square_score
+            - values[move.piece_moved][move.start_row][move.start_col]
+            + values[placed][move.end_row][move.end_col]
+        )
+
+        if move.is_en_passant:
+            score -= values[move.piece_captured][move.start_row][move.end_col]
+        elif move.piece_captured != "--":
+            score -= values[move.piece_captured][move.end_row][move.end_col]
+
+        if move.castling:
+            rook_values = values[move.piece_moved[0] + "R"][move.end_row]
+
+            if move.end_col - move.start_col == 2:  # Kingside castling
+                score += rook_values[move.end_col - 1] - rook_values[move.end_col + 1]
+            else:  # Queenside castling
+                score += rook_values[move.end_col + 1] - rook_values[move.end_col - 2]
+
+        self.square_score = score
+
     def update_castling_rights(self, move):
         """
         Updates the castling rights if castling has been achieved or any of the rights are violated.
+
+        Rights are lost when the king or a rook leaves its starting square, or
+        when a rook is captured there. A new `Castling` object replaces the
+        old one only when a right actually changes, so the undo log can keep
+        a reference to the previous rights instead of a copy.
         """
-        if move.piece_moved == "wK":
-            self.castling_rights.w_kingside = False
-            self.castling_rights.w_queenside = False
-        elif move.piece_moved == "bK":
-            self.castling_rights.b_kingside = False
-            self.castling_rights.b_queenside = False
-        elif move.piece_moved == "wR":
-            if move.start_row == 7:
-                if move.start_col == 0:
-                    self.castling_rights.w_queenside = False
-                elif move.start_col == 7:
-                    self.castling_rights.w_kingside = False
-        elif move.piece_moved == "bR":
-            if move.start_row == 0:
-                if move.start_col == 0:
-                    self.castling_rights.b_queenside = False
-                elif move.start_col == 7:
-                    self.castling_rights.b_kingside = False
+        lost = CASTLING_SQUARES.get((move.start_row, move.start_col), ()) + (
+            CASTLING_SQUARES.get((move.end_row, move.end_col), ())
+        )
+
+        if lost and any(getattr(self.castling_rights, side) for side in lost):
+            self.castling_rights = self.castling_rights.copy()
+
+            for side in lost:
+                setattr(self.castling_rights, side, False)
 
     def get_valid_moves(self):
         """
-        Gets valid/legal chess moves when king is in check.
+        Gets valid/legal chess moves.
+
+        Checking pieces and pinned pieces are found once per position. Pinned
+        pieces only get moves along their pin, and when in check only the
+        moves that capture or block the checking piece are kept.
+
+        With a move cache, a position seen recently gets a copy of the moves
+        found for it, along with its checkmate and stalemate flags.
         """
-        temp_en_passant = self.en_passant_possible
-        temp_castling_rights = Castling(
-            self.castling_rights.w_kingside,
-            self.castling_rights.w_queenside,
-            self.castling_rights.b_kingside,
-            self.castling_rights.b_queenside,
-        )
-        valid_moves = self.get_all_possible_moves()
-        length = len(valid_moves)
+        if self.move_cache is not None:
+            cached = self.move_cache.get(self.zobrist_key)
 
-        if self.white_to_move:
-            self.get_castling_moves(
-                self.white_king_location[0], self.white_king_location[-1], valid_moves
+            if cached is not None:
+                valid_moves, self.checkmate, self.stalemate = cached
+
+                return list(valid_moves)
+
+        in_check, pins, checks = self.check_for_pins_and_checks()
+        valid_moves = self.get_legal_moves(pins, checks)
+
+        if not in_check:
+            self.get_castling_moves(*self.get_king_location(), valid_moves)
+
+        self.set_game_over(in_check, len(valid_moves) > 0)
+
+        if self.move_cache is not None:
+            self.move_cache.put(
+                self.zobrist_key, (tuple(valid_moves), self.checkmate, self.stalemate)
             )
+
+        return valid_moves
+
+    def get_staged_moves(
+        self, priority_move=None, killers=(), capture_order=None, quiet_order=None
+    ):
+        """
+        Yields the legal moves in stages for the search: `priority_move` first
+        when it's legal here, then captures and promotions, then the `killers`
+        that are legal quiet moves, then the remaining quiet moves. The
+        captures and the quiet moves are sorted by the `capture_order` and
+        `quiet_order` key functions when given, highest first.
+
+        A stage is only generated once the previous one has been used up, so a
+        cutoff on an early move skips the work of the later stages. Moves may
+        be made and undone between yields. Checkmate and stalemate are set
+        once the moves run out.
+        """
+        in_check, pins, checks = self.check_for_pins_and_checks()
+        tried = set()
+
+        if priority_move is not None:
+            move = self.find_legal_move(priority_move, pins, checks, in_check)
+
+            if move is not None:
+                tried.add(move.move_id)
+                yield move
+
+        capture_moves = self.get_legal_moves(pins, checks, stage="captures")
+
+        if capture_order is not None:
+            capture_moves.sort(key=capture_order, reverse=True)
+
+        for move in capture_moves:
+            if move.move_id not in tried:
+                tried.add(move.move_id)
+                yield move
+
+        for killer in killers:
+            if killer is None or killer.move_id in tried:
+                continue
+
+            move = self.find_legal_move(killer, pins, checks, in_check)
+
+            if move is not None and not move.is_capture_move:
+                tried.add(move.move_id)
+                yield move
+
+        quiet_moves = self.get_legal_moves(pins, checks, stage="quiets")
+
+        if not in_check:
+            self.get_castling_moves(*self.get_king_location(), quiet_moves)
+
+        if quiet_order is not None:
+            quiet_moves.sort(key=quiet_order, reverse=True)
+
+        for move in quiet_moves:
+            if move.move_id not in tried:
+                tried.add(move.move_id)
+                yield move
+
+        self.set_game_over(in_check, len(tried) > 0)
+
+    def get_capture_moves(self):
+        """
+        Gets the legal captures and promotions only, for quiescence search.
+        """
+        in_check, pins, checks = self.check_for_pins_and_checks()
+
+        return self.get_legal_moves(pins, checks, stage="captures")
+
+    def find_legal_move(self, move, pins, checks, in_check):
+        """
+        Gets this position's legal move with the same squares as `move`, which
+        may come from another position, or None when there isn't one. Only
+        the moves of the piece on its starting square are generated.
+        """
+        if move.castling:
+            if in_check:
+                return None
+
+            candidates = []
+            self.get_castling_moves(*self.get_king_location(), candidates)
         else:
-            self.get_castling_moves(
-                self.black_king_location[0], self.black_king_location[-1], valid_moves
+            candidates = self.get_legal_moves(
+                pins, checks, square=(move.start_row, move.start_col)
             )
 
-        for val in range(length - 1, -1, -1):
-            self.make_move(valid_moves[val])
-
-            self.white_to_move = not self.white_to_move
+        for candidate in candidates:
+            if candidate == move:
+                return candidate
 
-            if self.in_check():
-                valid_moves.remove(valid_moves[val])
+        return None
 
-            self.white_to_move = not self.white_to_move
+    def get_legal_moves(self, pins, checks, stage=None, square=None):
+        """
+        Gets the legal moves other than castling, given the pins and checks
+        found by `check_for_pins_and_checks`. `stage` limits them to
+        "captures" (promotions included) or "quiets", and `square` to the
+        moves of the piece on that square.
+        """
+        self.pins = pins
+        king_row, king_col = self.get_king_location()
 
-            self.undo_move()
+        if len(checks) > 1:  # Double check -- only the king can move
+            valid_moves = []
 
-        if len(valid_moves) == 0:
-            if self.in_check():
-                self.checkmate = True
-            else:
-                self.stalemate = True
+            if square is None or square == (king_row, king_col):
+                self.get_king_moves(king_row, king_col, valid_moves, stage)
+        elif square is None:
+            valid_moves = self.get_all_possible_moves(stage)
         else:
+            valid_moves = []
+            row, col = square
+            piece = self.board[row][col]
+
+            if piece[0] == ("w" if self.white_to_move else "b"):
+                self.move_functions[piece[1]](row, col, valid_moves, stage)
+
+        if len(checks) == 1:
+            check_row, check_col, dir_row, dir_col = checks[0]
+            valid_squares = [(check_row, check_col)]
+
+            if self.board[check_row][check_col][1] != "N":
+                row, col = king_row + dir_row, king_col + dir_col
+
+                while (row, col) != (check_row, check_col):
+                    valid_squares.append((row, col))
+                    row, col = row + dir_row, col + dir_col
+
+            valid_moves = [
+                move
+                for move in valid_moves
+                if move.piece_moved[1] == "K"
+                or (move.end_row, move.end_col) in valid_squares
+                or (
+                    move.is_en_passant
+                    and (move.start_row, move.end_col) == (check_row, check_col)
+                )
+            ]
+
+        for val in range(len(valid_moves) - 1, -1, -1):
+            move = valid_moves[val]
+
+            if move.piece_moved[1] == "K":
+                if self.square_under_attack(move.end_row, move.end_col):
+                    del valid_moves[val]
+            elif move.is_en_passant:
+                # Taking en passant empties two squares of the same row, which
+                # may uncover an attack on the king
+                self.make_move(move)
+                self.white_to_move = not self.white_to_move
+
+                if self.in_check():
+                    del valid_moves[val]
+
+                self.white_to_move = not self.white_to_move
+                self.undo_move()
+
+        self.pins = {}
+
+        return valid_moves
+
+    def get_king_location(self):
+        if self.white_to_move:
+            return self.white_king_location
+
+        return self.black_king_location
+
+    def set_game_over(self, in_check, has_moves):
+        if has_moves:
             self.checkmate = False
             self.stalemate = False
+        elif in_check:
+            self.checkmate = True
+        else:
+            self.stalemate = True
+
+    def check_for_pins_and_checks(self):
+        """
+        Looks outwards from the king of the side to move for enemy pieces
+        giving check and for allied pieces pinned to the king.
 
-        self.en_passant_possible = temp_en_passant
-        self.castling_rights = temp_castling_rights
+        Returns whether the king is in check, the pins as a dict of
+        {(row, col): (dir_row, dir_col)} and the checks as a list of
+        (row, col, dir_row, dir_col), directions pointing away from the king.
+        """
+        if self.white_to_move:
+            ally_color, enemy_color = "w", "b"
+            row, col = self.white_king_location
+        else:
+            ally_color, enemy_color = "b", "w"
+            row, col = self.black_king_location
+
+        board = self.board
+        pins = {}
+        checks = []
+
+        for (dir_row, dir_col), ray in QUEEN_RAYS[row][col]:
+            possible_pin = None
+            # The enemy slider that attacks along this line
+            slider = "B" if dir_row != 0 and dir_col != 0 else "R"
+
+            for end_row, end_col in ray:
+                end_piece = board[end_row][end_col]
+
+                if end_piece[0] == ally_color:
+                    if possible_pin is None:
+                        possible_pin = (end_row, end_col)
+                    else:
+                        break
+                elif end_piece[0] == enemy_color:
+                    if end_piece[1] == slider or end_piece[1] == "Q":
+                        if possible_pin is None:
+                            checks.append((end_row, end_col, dir_row, dir_col))
+                        else:
+                            pins[possible_pin] = (dir_row, dir_col)
 
-        return valid_moves
+                    break
+
+        for end_row, end_col in PAWN_CAPTURES[ally_color][row][col]:
+            if board[end_row][end_col] == enemy_color + "p":
+                checks.append((end_row, end_col, end_row - row, end_col - col))
+
+        for end_row, end_col in KNIGHT_MOVES[row][col]:
+            if board[end_row][end_col] == enemy_color + "N":
+                checks.append((end_row, end_col, end_row - row, end_col - col))
+
+        return len(checks) > 0, pins, checks
+
+    def gives_check(self, move):
+        """
+        Checks whether `move`, a legal move other than castling, puts the
+        other king in check, by trying it on the board without making it.
+        """
+        board = self.board
+        victim_row = move.start_row if move.is_en_passant else move.end_row
+        placed = move.piece_moved
+
+        if move.is_pawn_promotion:
+            placed = placed[0] + "Q"
+
+        board[move.start_row][move.start_col] = "--"
+        board[victim_row][move.end_col] = "--"
+        board[move.end_row][move.end_col] = placed
+        self.white_to_move = not self.white_to_move
+        check = self.in_check()
+        self.white_to_move = not self.white_to_move
+        board[move.end_row][move.end_col] = "--"
+        board[victim_row][move.end_col] = move.piece_captured
+        board[move.start_row][move.start_col] = move.piece_moved
+
+        return check
 
     def in_check(self):
         """
@@ -337,312 +1012,230 @@ class GameState:
     def square_under_attack(self, row, col):
         """
         Looks for squares that are a chess piece's influence.
+
+        Checks whether the opponent attacks the square by looking outwards
+        from it -- knight jumps, pawn diagonals, the enemy king and the lines
+        of sliding pieces -- and stops at the first attacker found. The king
+        of the side to move doesn't block lines, so the squares it could step
+        to are judged as if it had already left its square.
         """
-        self.white_to_move = not self.white_to_move
-        opp_moves = self.get_all_possible_moves()
-        self.white_to_move = not self.white_to_move
+        if self.white_to_move:
+            ally_color, enemy_color = "w", "b"
+        else:
+            ally_color, enemy_color = "b", "w"
+
+        board = self.board
+        enemy_knight = enemy_color + "N"
+        enemy_pawn = enemy_color + "p"
+        enemy_king = enemy_color + "K"
+        ally_king = ally_color + "K"
+
+        for end_row, end_col in KNIGHT_MOVES[row][col]:
+            if board[end_row][end_col] == enemy_knight:
+                return True
+
+        for end_row, end_col in PAWN_CAPTURES[ally_color][row][col]:
+            if board[end_row][end_col] == enemy_pawn:
+                return True
 
-        for move in opp_moves:
-            if move.end_row == row and move.end_col == col:
+        for end_row, end_col in KING_MOVES[row][col]:
+            if board[end_row][end_col] == enemy_king:
                 return True
 
+        for (dir_row, dir_col), ray in QUEEN_RAYS[row][col]:
+            slider = "B" if dir_row != 0 and dir_col != 0 else "R"
+
+            for end_row, end_col in ray:
+                end_piece = board[end_row][end_col]
+
+                if end_piece == "--" or end_piece == ally_king:
+                    continue
+
+                if end_piece[0] == enemy_color and (
+                    end_piece[1] == slider or end_piece[1] == "Q"
+                ):
+                    return True
+
+                break
+
         return False
 
-    def get_all_possible_moves(self):
+    def get_attack_map(self, color):
         """
-        Gets all possible valid moves.
+        Counts, for every square, how many pieces of `color` ('w' or 'b')
+        attack it. Squares held by that side's own pieces count as attacked
+        when they are defended. Returned as an 8-by-8 list of integers.
         """
-        possible_moves = []
+        attack_map = [[0 for col in range(8)] for row in range(8)]
+        board = self.board
+        leaper_tables = {"p": PAWN_CAPTURES[color], "N": KNIGHT_MOVES, "K": KING_MOVES}
+        slider_tables = {"B": BISHOP_RAYS, "R": ROOK_RAYS, "Q": QUEEN_RAYS}
 
-        for row in range(len(self.board)):
-            for col in range(len(self.board[row])):
-                piece_color = self.board[row][col][0]
+        for row, col in self.piece_squares[color]:
+            kind = board[row][col][1]
 
-                if (piece_color == "w" and self.white_to_move) or (
-                    piece_color == "b" and not self.white_to_move
-                ):
-                    piece = self.board[row][col][-1]
+            if kind in leaper_tables:
+                for end_row, end_col in leaper_tables[kind][row][col]:
+                    attack_map[end_row][end_col] += 1
+            else:
+                for direction, ray in slider_tables[kind][row][col]:
+                    for end_row, end_col in ray:
+                        attack_map[end_row][end_col] += 1
+
+                        if board[end_row][end_col] != "--":
+                            break
+
+        return attack_map
+
+    def get_all_possible_moves(self, stage=None):
+        """
+        Gets all possible valid moves, or only the "captures" or "quiets"
+        stage of them.
+        """
+        possible_moves = []
 
-                    self.move_functions[piece](row, col, possible_moves)
+        for row, col in self.piece_squares["w" if self.white_to_move else "b"]:
+            piece = self.board[row][col][-1]
+
+            self.move_functions[piece](row, col, possible_moves, stage)
 
         return possible_moves
 
-    def get_pawn_moves(self, row, col, moves) -> list[object]:
-        if self.white_to_move:
-            if row - 1 >= 0 and self.board[row - 1][col] == "--":
-                moves.append(Move((row, col), (row - 1, col), self.board))
-                if row == 6 and self.board[row - 2][col] == "--":
-                    moves.append(Move((row, col), (row - 2, col), self.board))
-            if col - 1 >= 0 and row - 1 >= 0:
-                if self.board[row - 1][col - 1][0] == "b":
-                    moves.append(Move((row, col), (row - 1, col - 1), self.board))
-                if (row - 1, col - 1) == self.en_passant_possible:
-                    moves.append(
-                        Move(
-                            (row, col), (row - 1, col - 1), self.board, en_passant=True
-                        )
-                    )
-            if col + 1 < len(self.board[row]) and row - 1 >= 0:
-                if self.board[row - 1][col + 1][0] == "b":
-                    moves.append(Move((row, col), (row - 1, col + 1), self.board))
-                if (row - 1, col + 1) == self.en_passant_possible:
-                    moves.append(
-                        Move(
-                            (row, col), (row - 1, col + 1), self.board, en_passant=True
-                        )
-                    )
-        else:
-            if row + 1 < len(self.board) and self.board[row + 1][col] == "--":
-                moves.append(Move((row, col), (row + 1, col), self.board))
-                if row == 1 and self.board[row + 2][col] == "--":
-                    moves.append(Move((row, col), (row + 2, col), self.board))
-            if col - 1 >= 0 and row + 1 < len(self.board):
-                if self.board[row + 1][col - 1][0] == "w":
-                    moves.append(Move((row, col), (row + 1, col - 1), self.board))
-                if (row + 1, col - 1) == self.en_passant_possible:
-                    moves.append(
-                        Move(
-                            (row, col), (row + 1, col - 1), self.board, en_passant=True
-                        )
-                    )
-            if col + 1 < len(self.board[row]) and row + 1 < len(self.board):
-                if self.board[row + 1][col + 1][0] == "w":
-                    moves.append(Move((row, col), (row + 1, col + 1), self.board))
-                if (row + 1, col + 1) == self.en_passant_possible:
-                    moves.append(
-                        Move(
-                            (row, col), (row + 1, col + 1), self.board, en_passant=True
-                        )
+    def get_pawn_moves(self, row, col, moves, stage=None) -> list[object]:
+        """
+        Gets all the valid pawn moves. A pinned pawn may still push along a
+        file pin, or capture along a diagonal pin. Pushes to the last row are
+        promotions, which belong to the "captures" stage.
+        """
+        pin = self.pins.get((row, col))
+        board = self.board
+        piece = board[row][col]
+        ally_color, enemy_color = ("w", "b") if self.white_to_move else ("b", "w")
+
+        if pin is None or pin[1] == 0:
+            for end_row, end_col in PAWN_PUSHES[ally_color][row][col]:
+                if board[end_row][end_col] != "--":
+                    break
+
+                if stage is None or (stage == "captures") == (end_row in (0, 7)):
+                    moves.append(Move.create(row, col, end_row, end_col, piece, "--"))
+
+        if stage == "quiets":
+            return moves
+
+        for end_row, end_col in PAWN_CAPTURES[ally_color][row][col]:
+            if pin and pin[0] * (end_col - col) != pin[1] * (end_row - row):
+                continue
+
+            end_piece = board[end_row][end_col]
+
+            if end_piece[0] == enemy_color:
+                moves.append(Move.create(row, col, end_row, end_col, piece, end_piece))
+            elif (end_row, end_col) == self.en_passant_possible:
+                moves.append(
+                    Move.create(
+                        row,
+                        col,
+                        end_row,
+                        end_col,
+                        piece,
+                        enemy_color + "p",
+                        en_passant=True,
                     )
+                )
 
         return moves
 
-    def get_knight_moves(self, row, col, moves) -> list[object]:
+    def get_knight_moves(self, row, col, moves, stage=None) -> list[object]:
         """
         Gets all the valid knight moves.
         """
-        knight_coordinates = [
-            (-2, -1),
-            (-2, 1),
-            (2, -1),
-            (2, 1),
-            (1, -2),
-            (1, 2),
-            (-1, -2),
-            (-1, 2),
-        ]
+        if (row, col) in self.pins:  # A pinned knight can never move
+            return moves
 
-        if self.white_to_move:
-            for coordinates in knight_coordinates:
-                coord_row = coordinates[0]
-                coord_col = coordinates[-1]
+        board = self.board
+        piece = board[row][col]
+        ally_color = piece[0]
 
-                if (0 <= row + coord_row <= 7) and (0 <= col + coord_col <= 7):
-                    if self.board[row + coord_row][col + coord_col][0] in ["b", "-"]:
-                        moves.append(
-                            Move(
-                                (row, col),
-                                (row + coord_row, col + coord_col),
-                                self.board,
-                            )
-                        )
-        else:
-            for coordinates in knight_coordinates:
-                coord_row = coordinates[0]
-                coord_col = coordinates[-1]
-
-                if (
-                    (0 <= row + coord_row <= 7)
-                    and (0 <= col + coord_col <= 7)
-                    and self.board[row + coord_row][col + coord_col][0] in ["w", "-"]
-                ):
-                    moves.append(
-                        Move((row, col), (row + coord_row, col + coord_col), self.board)
-                    )
+        for end_row, end_col in KNIGHT_MOVES[row][col]:
+            end_piece = board[end_row][end_col]
+
+            if end_piece[0] != ally_color and _in_stage(end_piece, stage):
+                moves.append(Move.create(row, col, end_row, end_col, piece, end_piece))
 
         return moves
 
-    def get_bishop_moves(self, row, col, moves) -> list[object]:
+    def get_bishop_moves(self, row, col, moves, stage=None) -> list[object]:
         """
         Gets all the valid bishop moves.
         """
-        bishop_offsets = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+        return self.get_sliding_moves(row, col, BISHOP_RAYS[row][col], moves, stage)
 
-        if self.white_to_move:
-            for offset in bishop_offsets:
-                for num in range(1, 8):
-                    off_row = offset[0] * num
-                    off_col = offset[1] * num
-
-                    if (0 <= row + off_row <= 7) and (0 <= col + off_col <= 7):
-                        if self.board[row + off_row][col + off_col][0] == "b":
-                            moves.append(
-                                Move(
-                                    (row, col),
-                                    (row + off_row, col + off_col),
-                                    self.board,
-                                )
-                            )
-                            break
-                        elif self.board[row + off_row][col + off_col][0] == "-":
-                            moves.append(
-                                Move(
-                                    (row, col),
-                                    (row + off_row, col + off_col),
-                                    self.board,
-                                )
-                            )
-                        elif self.board[row + off_row][col + off_col][0] == "w":
-                            break
-        else:
-            for offset in bishop_offsets:
-                for num in range(1, 8):
-                    off_row = offset[0] * num
-                    off_col = offset[1] * num
-
-                    if (0 <= row + off_row <= 7) and (0 <= col + off_col <= 7):
-                        if self.board[row + off_row][col + off_col][0] == "w":
-                            moves.append(
-                                Move(
-                                    (row, col),
-                                    (row + off_row, col + off_col),
-                                    self.board,
-                                )
-                            )
-                            break
-                        elif self.board[row + off_row][col + off_col][0] == "-":
-                            moves.append(
-                                Move(
-                                    (row, col),
-                                    (row + off_row, col + off_col),
-                                    self.board,
-                                )
-                            )
-                        elif self.board[row + off_row][col + off_col][0] == "b":
-                            break
-
-        return moves
-
-    def get_rook_moves(self, row, col, moves) -> list[object]:
+    def get_rook_moves(self, row, col, moves, stage=None) -> list[object]:
         """
         Gets all the valid rook moves.
         """
-        rook_offsets = [(-1, 0), (0, 1), (1, 0), (0, -1)]
+        return self.get_sliding_moves(row, col, ROOK_RAYS[row][col], moves, stage)
 
-        if self.white_to_move:
-            for offset in rook_offsets:
-                for num in range(1, 8):
-                    off_row = offset[0] * num
-                    off_col = offset[1] * num
-
-                    if (0 <= row + off_row <= 7) and (0 <= col + off_col <= 7):
-                        if self.board[row + off_row][col + off_col][0] == "b":
-                            moves.append(
-                                Move(
-                                    (row, col),
-                                    (row + off_row, col + off_col),
-                                    self.board,
-                                )
-                            )
-                            break
-                        elif self.board[row + off_row][col + off_col][0] == "-":
-                            moves.append(
-                                Move(
-                                    (row, col),
-                                    (row + off_row, col + off_col),
-                                    self.board,
-                                )
-                            )
-                        else:
-                            break
-        else:
-            for offset in rook_offsets:
-                for num in range(1, 8):
-                    off_row = offset[0] * num
-                    off_col = offset[1] * num
-
-                    if (0 <= row + off_row <= 7) and (0 <= col + off_col <= 7):
-                        if self.board[row + off_row][col + off_col][0] == "w":
-                            moves.append(
-                                Move(
-                                    (row, col),
-                                    (row + off_row, col + off_col),
-                                    self.board,
-                                )
-                            )
-                            break
-                        elif self.board[row + off_row][col + off_col][0] == "-":
-                            moves.append(
-                                Move(
-                                    (row, col),
-                                    (row + off_row, col + off_col),
-                                    self.board,
-                                )
-                            )
-                        else:
-                            break
-
-        return moves
-
-    def get_queen_moves(self, row, col, moves) -> list[object]:
+    def get_queen_moves(self, row, col, moves, stage=None) -> list[object]:
         """
         Gets all the valid queen moves.
         """
-        self.get_bishop_moves(row, col, moves)
-        self.get_rook_moves(row, col, moves)
+        return self.get_sliding_moves(row, col, QUEEN_RAYS[row][col], moves, stage)
 
-    def get_king_moves(self, row, col, moves) -> list[object]:
+    def get_sliding_moves(self, row, col, rays, moves, stage=None) -> list[object]:
         """
-        Gets all the valid king moves.
+        Follows each ray up to the first piece, which may be captured if it's
+        an enemy. A pinned piece only slides along its pin line.
         """
-        king_offsets = [
-            (-1, -1),
-            (-1, 0),
-            (-1, 1),
-            (0, -1),
-            (0, 1),
-            (1, -1),
-            (1, 0),
-            (1, 1),
-        ]
-        ally_color = "w" if self.white_to_move else "b"
+        pin = self.pins.get((row, col))
+        board = self.board
+        piece = board[row][col]
+        ally_color = piece[0]
 
-        if self.white_to_move:
-            for offset in king_offsets:
-                off_row = offset[0]
-                off_col = offset[1]
+        for (dir_row, dir_col), ray in rays:
+            if pin and pin[0] * dir_col != pin[1] * dir_row:
+                continue
 
-                if (0 <= row + off_row <= 7) and (0 <= col + off_col <= 7):
-                    if self.board[row + off_row][col + off_col][0] != ally_color:
+            for end_row, end_col in ray:
+                end_piece = board[end_row][end_col]
+
+                if end_piece == "--":
+                    if stage != "captures":
                         moves.append(
-                            Move(
-                                (row, col),
-                                (row + off_row, col + off_col),
-                                self.board,
-                            )
+                            Move.create(row, col, end_row, end_col, piece, "--")
                         )
-        else:
-            for offset in king_offsets:
-                off_row = offset[0]
-                off_col = offset[1]
-
-                if (0 <= row + off_row <= 7) and (0 <= col + off_col <= 7):
-                    if self.board[row + off_row][col + off_col][0] != ally_color:
+                else:
+                    if end_piece[0] != ally_color and stage != "quiets":
                         moves.append(
-                            Move(
-                                (row, col),
-                                (row + off_row, col + off_col),
-                                self.board,
-                            )
+                            Move.create(row, col, end_row, end_col, piece, end_piece)
                         )
 
-    def get_castling_moves(self, row, col, moves):
+                    break
+
+        return moves
+
+    def get_king_moves(self, row, col, moves, stage=None) -> list[object]:
         """
-        Get all valid castling moves for both white and black.
+        Gets all the valid king moves.
         """
-        if self.square_under_attack(row, col):
-            pass
+        board = self.board
+        piece = board[row][col]
+        ally_color = piece[0]
+
+        for end_row, end_col in KING_MOVES[row][col]:
+            end_piece = board[end_row][end_col]
+
+            if end_piece[0] != ally_color and _in_stage(end_piece, stage):
+                moves.append(Move.create(row, col, end_row, end_col, piece, end_piece))
+
+        return moves
 
+    def get_castling_moves(self, row, col, moves):
+        """
+        Get all valid castling moves for both white and black. Castling out of
+        check isn't allowed, so this is only called when the king is safe.
+        """
         if (self.white_to_move and self.castling_rights.w_kingside) or (
             (not self.white_to_move) and self.castling_rights.b_kingside
         ):
@@ -685,6 +1278,70 @@ class GameState:
                 )
 
 
+def _in_stage(end_piece, stage):
+    """
+    Whether a move onto a square holding `end_piece` belongs to the stage.
+    """
+    if stage is None:
+        return True
+
+    return (stage == "captures") == (end_piece != "--")
+
+
+class MoveCache:
+    """
+    A least-recently-used map from a position's Zobrist key to its legal
+    moves, using about `size_mb` megabytes. Positions have from none to a
+    couple hundred moves, so the cache counts the memory of its entries,
+    `memory` bytes, rather than the positions. `hits` and `misses` count the
+    lookups.
+    """
+
+    def __init__(self, size_mb):
+        self.size_mb = size_mb
+        self.capacity = int(size_mb * (1 << 20))
+        self.entries = OrderedDict()
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def entry_size(entry):
+        """
+        Estimates the bytes an entry of (moves, checkmate, stalemate) takes.
+        """
+        return MOVE_CACHE_ENTRY_BYTES + len(entry[0]) * MOVE_CACHE_MOVE_BYTES
+
+    def get(self, key):
+        entry = self.entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+
+        return entry
+
+    def put(self, key, entry):
+        old_entry = self.entries.pop(key, None)
+
+        if old_entry is not None:
+            self.memory -= self.entry_size(old_entry)
+
+        self.entries[key] = entry
+        self.memory += self.entry_size(entry)
+
+        while self.memory > self.capacity and self.entries:
+            self.memory -= self.entry_size(self.entries.popitem(last=False)[1])
+
+    def clear(self):
+        self.entries.clear()
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+
+
 class Castling:
     """
     This class implements the castling rights for both black and white on the kingside and queenside.
@@ -703,10 +1360,35 @@ class Castling:
 
 
 class Move:
+    """
+    A move of one piece from a start square to an end square.
+
+    `move_id` packs the start square into bits 0-5 and the end square into
+    bits 6-11, counting squares as row * 8 + col. It tells apart every move
+    of a position, so it backs equality and hashing, and moves can be used
+    as dict or set keys. `pack` adds the flag bits on top of it.
+    """
+
+    __slots__ = (
+        "start_row",
+        "start_col",
+        "end_row",
+        "end_col",
+        "piece_moved",
+        "piece_captured",
+        "is_pawn_promotion",
+        "is_en_passant",
+        "castling",
+        "move_id",
+    )
+
     RANKS_TO_ROWS = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     ROWS_TO_RANKS = {v: k for k, v in RANKS_TO_ROWS.items()}
     FILES_TO_COLS = {chr(97 + num): num for num in range(8)}
     COLS_TO_FILES = {v: k for k, v in FILES_TO_COLS.items()}
+    EN_PASSANT_FLAG = 1 << 12
+    CASTLING_FLAG = 1 << 13
+    PROMOTION_FLAG = 1 << 14  # Pawns always promote to a queen
 
     def __init__(
         self, start_square, end_square, board, en_passant=False, castling=False
@@ -722,24 +1404,97 @@ class Move:
         )
         self.is_en_passant = en_passant
         self.castling = castling
-        self.is_capture_move = self.piece_captured != "--"
 
         if self.is_en_passant:
             self.piece_captured = "wp" if self.piece_moved == "bp" else "bp"
 
         self.move_id = (
-            (self.start_row * 1000)
-            + (self.start_col * 100)
-            + (self.end_row * 10)
-            + self.end_col
+            self.start_row * 8
+            + self.start_col
+            + ((self.end_row * 8 + self.end_col) << 6)
         )
 
+    @classmethod
+    def create(
+        cls,
+        start_row,
+        start_col,
+        end_row,
+        end_col,
+        piece_moved,
+        piece_captured,
+        en_passant=False,
+        castling=False,
+    ):
+        """
+        Builds a move from pieces the caller already knows, without reading
+        the board. Used by the move generators.
+
+        The generators always build full moves, not packed ints: the legality
+        checks against pins and checks, the move ordering and `make_move` all
+        read these fields, so a packed path would need a second copy of each.
+        Packed moves are for storing, as in the transposition table.
+        """
+        move = cls.__new__(cls)
+        move.start_row = start_row
+        move.start_col = start_col
+        move.end_row = end_row
+        move.end_col = end_col
+        move.piece_moved = piece_moved
+        move.piece_captured = piece_captured
+        move.is_pawn_promotion = piece_moved[1] == "p" and (
+            end_row == 0 or end_row == 7
+        )
+        move.is_en_passant = en_passant
+        move.castling = castling
+        move.move_id = start_row * 8 + start_col + ((end_row * 8 + end_col) << 6)
+
+        return move
+
+    def pack(self):
+        """
+        Packs the move into a single int: `move_id` plus the en passant,
+        castling and promotion flags.
+        """
+        packed = self.move_id
+
+        if self.is_en_passant:
+            packed |= Move.EN_PASSANT_FLAG
+        if self.castling:
+            packed |= Move.CASTLING_FLAG
+        if self.is_pawn_promotion:
+            packed |= Move.PROMOTION_FLAG
+
+        return packed
+
+    @classmethod
+    def unpack(cls, packed, board):
+        """
+        Rebuilds a packed move for the position on `board`.
+        """
+        start, end = packed & 63, (packed >> 6) & 63
+
+        return cls(
+            (start >> 3, start & 7),
+            (end >> 3, end & 7),
+            board,
+            en_passant=bool(packed & Move.EN_PASSANT_FLAG),
+            castling=bool(packed & Move.CASTLING_FLAG),
+        )
+
+    @property
+    def is_capture_move(self):
+        return self.piece_captured != "--"
+
     def __eq__(self, other):
         if isinstance(other, Move):
             return self.move_id == other.move_id
 
         return False
 
+    def __hash__(self):
+        return self.move_id
+
     def __str__(self):
         if self.castling:
             return "O-O" if self.end_col == 6 else "O-O-O"
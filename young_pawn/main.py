@@ -14,6 +14,8 @@ MAX_FPS = 15
 IMAGES = {}
 MOVE_LOG_PANEL_WIDTH = 256
 MOVE_LOG_PANEL_HEIGHT = HEIGHT
+MOVE_CACHE_MB = 16  # Memory for the legal moves of recent positions
+AI_TIME_LIMIT = 1.0  # Seconds the AI may think about a move
 
 
 def draw_board(screen):
@@ -251,7 +253,10 @@ def main():
 
     screen.fill(p.Color("white"))
 
-    game_state = chess_engine.GameState()
+    game_state = chess_engine.GameState(
+        move_cache_mb=MOVE_CACHE_MB,
+        square_values=chess_ai.SQUARE_VALUES,
+    )
     valid_moves = game_state.get_valid_moves()
     move_made = False
     animate = False
@@ -320,7 +325,10 @@ def main():
                     game_over = False
 
                 if event.key == p.K_r:
-                    game_state = chess_engine.GameState()
+                    game_state = chess_engine.GameState(
+                        move_cache_mb=MOVE_CACHE_MB,
+                        square_values=chess_ai.SQUARE_VALUES,
+                    )
                     valid_moves = game_state.get_valid_moves()
                     square_selected = ()
                     player_clicks = []
@@ -345,7 +353,7 @@ def main():
         # Handle AI move
         if not game_over and not human_to_play:
             ai_move = chess_ai.find_best_move_nega_max_alpha_beta(
-                game_state, valid_moves
+                game_state, valid_moves, time_limit=AI_TIME_LIMIT
             )
 
             if not ai_move:
@@ -380,6 +388,12 @@ def main():
         elif game_state.stalemate:
             game_over = True
             draw_endgame_result_text(screen, "Stalemate")
+        elif game_state.threefold_repetition:
+            game_over = True
+            draw_endgame_result_text(screen, "Draw by repetition")
+        elif game_state.fifty_move_rule:
+            game_over = True
+            draw_endgame_result_text(screen, "Draw by fifty-move rule")
 
         # Update the display
         clock.tick(MAX_FPS)
@@ -0,0 +1,105 @@
+"""
+Lookup tables for move generation and attack checks, built once at import.
+
+Every table is indexed by [row][col] of the starting square and holds the
+squares reachable from it as (row, col) tuples, so the generators never have
+to rebuild offset lists or bounds-check a step.
+"""
+
+KNIGHT_OFFSETS = [
+    (-2, -1),
+    (-2, 1),
+    (2, -1),
+    (2, 1),
+    (1, -2),
+    (1, 2),
+    (-1, -2),
+    (-1, 2),
+]
+ROOK_DIRECTIONS = [(-1, 0), (0, 1), (1, 0), (0, -1)]
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+KING_OFFSETS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+
+
+def _on_board(row, col):
+    return 0 <= row <= 7 and 0 <= col <= 7
+
+
+def _build_leaper_table(offsets):
+    return [
+        [
+            tuple(
+                (row + off_row, col + off_col)
+                for off_row, off_col in offsets
+                if _on_board(row + off_row, col + off_col)
+            )
+            for col in range(8)
+        ]
+        for row in range(8)
+    ]
+
+
+def _build_ray(row, col, dir_row, dir_col):
+    ray = []
+    row, col = row + dir_row, col + dir_col
+
+    while _on_board(row, col):
+        ray.append((row, col))
+        row, col = row + dir_row, col + dir_col
+
+    return tuple(ray)
+
+
+def _build_slider_table(directions):
+    """
+    For each square, the non-empty rays as ((dir_row, dir_col), squares) pairs,
+    with the squares ordered outwards from the starting square.
+    """
+    return [
+        [
+            tuple(
+                (direction, RAYS[row][col][direction])
+                for direction in directions
+                if RAYS[row][col][direction]
+            )
+            for col in range(8)
+        ]
+        for row in range(8)
+    ]
+
+
+def _build_pawn_pushes(color):
+    step, start_row = (-1, 6) if color == "w" else (1, 1)
+    pushes = [[() for col in range(8)] for row in range(8)]
+
+    for row in range(1, 7):
+        for col in range(8):
+            if row == start_row:
+                pushes[row][col] = ((row + step, col), (row + 2 * step, col))
+            else:
+                pushes[row][col] = ((row + step, col),)
+
+    return pushes
+
+
+KNIGHT_MOVES = _build_leaper_table(KNIGHT_OFFSETS)
+KING_MOVES = _build_leaper_table(KING_OFFSETS)
+# RAYS[row][col][direction] -- every direction, even when the ray is empty
+RAYS = [
+    [
+        {direction: _build_ray(row, col, *direction) for direction in KING_OFFSETS}
+        for col in range(8)
+    ]
+    for row in range(8)
+]
+ROOK_RAYS = _build_slider_table(ROOK_DIRECTIONS)
+BISHOP_RAYS = _build_slider_table(BISHOP_DIRECTIONS)
+QUEEN_RAYS = _build_slider_table(KING_OFFSETS)
+# Pushes are listed nearest first, so a blocked first step ends the list.
+# A pawn of a colour captures on PAWN_CAPTURES[colour][row][col], which are
+# also the squares an enemy pawn must stand on to attack that square.
+PAWN_PUSHES = {color: _build_pawn_pushes(color) for color in ("w", "b")}
+PAWN_CAPTURES = {
+    "w": _build_leaper_table([(-1, -1), (-1, 1)]),
+    "b": _build_leaper_table([(1, -1), (1, 1)]),
+}
@@ -0,0 +1,281 @@
+"""
+Counts the leaf nodes of the move tree to a given depth (perft), to check the
+move generator against known node counts and to time it. Run it from this
+folder:
+
+    python -m perft                         # every reference position
+    python -m perft -d 4 -p kiwipete        # one position, deeper
+    python -m perft -d 2 --divide --fen "8/8/8/8/8/8/8/K1k5 w - - 0 1"
+    python -m perft -d 5 -j 8 --split 2     # eight processes
+
+Pawns always promote to a queen here, so the expected counts leave out the
+under-promotions and are lower than the published ones wherever a pawn can
+promote within the depth.
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import chess_engine
+
+
+# name: (FEN, node counts from depth 1 upwards)
+POSITIONS = {
+    "start": (
+        "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+        (20, 400, 8902, 197281, 4865609),
+    ),
+    "kiwipete": (
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        (48, 2039, 97862, 4074224),
+    ),
+    "endgame": (
+        "8/2p5/3p4/KP5r/1R3p2/4P1k1/6P1/8 w - - 0 1",
+        (12, 266, 3610, 67759, 1005186),
+    ),
+    "promotions": (
+        "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        (6, 228, 8087, 320802),
+    ),
+    "promotions_black": (
+        "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+        (6, 228, 8087, 320802),
+    ),
+    "discovered_check": (
+        "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        (41, 1373, 54007, 1806790),
+    ),
+    "middlegame": (
+        "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        (46, 2079, 89890, 3894594),
+    ),
+    "en_passant_pin": (
+        "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1",
+        (15, 126, 1928, 13931, 206136, 1438912),
+    ),
+    "en_passant_check": (
+        "8/8/8/2k5/2pP4/8/B7/4K3 b - d3 0 3",
+        (8, 72, 492, 5380, 36600, 443343),
+    ),
+    "castling_through_check": (
+        "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1",
+        (26, 1141, 27826, 1274206),
+    ),
+    "promotion_check": (
+        "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1",
+        (5, 75, 694, 9674, 128641, 1783549),
+    ),
+}
+DEFAULT_DEPTH = 3
+
+
+def perft(game_state, depth):
+    """
+    Counts the positions reached after exactly `depth` moves.
+    """
+    if depth == 0:
+        return 1
+
+    moves = game_state.get_valid_moves()
+
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+
+    for move in moves:
+        game_state.make_move(move)
+        nodes += perft(game_state, depth - 1)
+        game_state.undo_move()
+
+    return nodes
+
+
+def divide(game_state, depth):
+    """
+    Splits the perft count by root move, as {move in UCI form: nodes}.
+    """
+    counts = {}
+
+    for move in game_state.get_valid_moves():
+        game_state.make_move(move)
+        counts[uci(move)] = perft(game_state, depth - 1)
+        game_state.undo_move()
+
+    return counts
+
+
+def parallel_divide(game_state, depth, workers=None, split_depth=1):
+    """
+    `divide` spread over a pool of `workers` processes. Each job is the
+    position after a root move, or with `split_depth` 2 after a root move and
+    a reply, sent to a worker as a FEN string. The counts are summed back up
+    per root move.
+    """
+    counts = {}
+    keys, fens, depths = [], [], []
+
+    for move in game_state.get_valid_moves():
+        key = uci(move)
+        counts[key] = 0
+        game_state.make_move(move)
+
+        if split_depth > 1 and depth > 2:
+            for reply in game_state.get_valid_moves():
+                game_state.make_move(reply)
+                keys.append(key)
+                fens.append(game_state.to_fen())
+                depths.append(depth - 2)
+                game_state.undo_move()
+        else:
+            keys.append(key)
+            fens.append(game_state.to_fen())
+            depths.append(depth - 1)
+
+        game_state.undo_move()
+
+    with ProcessPoolExecutor(workers) as executor:
+        results = executor.map(_perft_fen, fens, depths)
+
+        for key, nodes in zip(keys, results):
+            counts[key] += nodes
+
+    return counts
+
+
+def _perft_fen(fen, depth):
+    return perft(chess_engine.GameState.from_fen(fen), depth)
+
+
+def uci(move):
+    """
+    Writes a move as its start and end squares, plus 'q' for a promotion.
+    """
+    start = move.get_rank_file(move.start_row, move.start_col)
+    end = move.get_rank_file(move.end_row, move.end_col)
+
+    return start + end + ("q" if move.is_pawn_promotion else "")
+
+
+def run(
+    name,
+    fen,
+    depth,
+    expected=None,
+    show_divide=False,
+    workers=1,
+    split_depth=1,
+):
+    """
+    Runs perft on one position and prints the count, the expected count when
+    known, and the speed. Returns False on a wrong count. With more than one
+    worker, the root moves are counted in parallel.
+    """
+    game_state = chess_engine.GameState.from_fen(fen)
+    start = time.perf_counter()
+
+    if workers > 1 and depth > 1:
+        counts = parallel_divide(game_state, depth, workers, split_depth)
+        nodes = sum(counts.values())
+    elif show_divide:
+        counts = divide(game_state, depth)
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(game_state, depth)
+
+    if show_divide:
+
+        for move, count in sorted(counts.items()):
+            print(f"  {move}: {count}")
+
+    elapsed = time.perf_counter() - start
+    speed = nodes / elapsed if elapsed > 0 else 0.0
+
+    if expected is None:
+        verdict = "expected unknown"
+    elif nodes == expected:
+        verdict = "ok"
+    else:
+        verdict = f"FAILED, expected {expected}"
+
+    print(
+        f"{name:<24} depth {depth}  {nodes:>10} nodes  {elapsed:7.2f}s  "
+        f"{speed:>9,.0f} nodes/s  {verdict}"
+    )
+
+    return expected is None or nodes == expected
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="perft", description="Counts move-tree leaf nodes to a given depth."
+    )
+    parser.add_argument(
+        "-d",
+        "--depth",
+        type=int,
+        help="search depth, by default each position's deepest known count "
+        f"up to depth {DEFAULT_DEPTH}",
+    )
+    parser.add_argument(
+        "-p",
+        "--position",
+        action="append",
+        choices=sorted(POSITIONS),
+        help="reference position to run, may be repeated (default: all)",
+    )
+    parser.add_argument("--fen", help="run this position instead")
+    parser.add_argument(
+        "--divide", action="store_true", help="print the count of each root move"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        nargs="?",
+        const=os.cpu_count(),
+        default=1,
+        help="worker processes, all the cores when no number is given",
+    )
+    parser.add_argument(
+        "--split",
+        type=int,
+        choices=(1, 2),
+        default=1,
+        help="plies to expand before handing positions to the workers",
+    )
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        jobs = [("fen", args.fen, ())]
+    else:
+        jobs = [(name, *POSITIONS[name]) for name in args.position or POSITIONS]
+
+    passed = True
+
+    for name, fen, counts in jobs:
+        if args.depth is not None:
+            depth = args.depth
+        else:
+            depth = min(DEFAULT_DEPTH, len(counts)) or DEFAULT_DEPTH
+
+        expected = counts[depth - 1] if 0 < depth <= len(counts) else None
+
+        passed &= run(
+            name,
+            fen,
+            depth,
+            expected,
+            args.divide,
+            args.jobs,
+            args.split,
+        )
+
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Times the search to a fixed depth on its own and spread over worker
+processes, to see how `find_best_move_parallel` scales with the cores. Run it
+from this folder:
+
+    python -m search_bench                  # depth 4, 1 worker up to all cores
+    python -m search_bench -d 5 -j 2 4 8    # deeper, with 2, 4 and 8 workers
+    python -m search_bench -p kiwipete
+
+Each search starts with an empty transposition table and the same shuffle of
+the root moves. The parallel times include starting the worker processes.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import chess_ai
+import chess_engine
+import perft
+
+
+POSITIONS = ("start", "kiwipete", "middlegame", "endgame")
+DEFAULT_DEPTH = 4
+
+
+def search(fen, depth, workers=None):
+    """
+    Searches the position to `depth`, with `workers` processes or without
+    any, and returns the move, the nodes and the seconds taken.
+    """
+    game_state = chess_engine.GameState.from_fen(
+        fen, square_values=chess_ai.SQUARE_VALUES
+    )
+    searcher = chess_ai.Searcher(depth)
+    chess_ai.r.seed(0)
+    start = time.perf_counter()
+
+    if workers is None:
+        move = searcher.find_best_move_nega_max_alpha_beta(
+            game_state, game_state.get_valid_moves()
+        )
+    else:
+        move = searcher.find_best_move_parallel(
+            game_state, game_state.get_valid_moves(), workers=workers
+        )
+
+    return move, searcher.context.nodes, time.perf_counter() - start
+
+
+def run(name, fen, depth, worker_counts):
+    """
+    Prints the serial search and then each parallel one, with its speedup.
+    Returns the seconds of each, serial first.
+    """
+    move, nodes, serial = search(fen, depth)
+    times = [serial]
+    print(
+        f"{name:<12} serial      {move.get_chess_notation():<8} "
+        f"{nodes:>9} nodes  {serial:7.2f}s"
+    )
+
+    for workers in worker_counts:
+        move, nodes, elapsed = search(fen, depth, workers)
+        times.append(elapsed)
+        print(
+            f"{name:<12} {workers:>2} workers  {move.get_chess_notation():<8} "
+            f"{nodes:>9} nodes  {elapsed:7.2f}s  {serial / elapsed:5.2f}x"
+        )
+
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="search_bench",
+        description="Times the serial search against the parallel one.",
+    )
+    parser.add_argument(
+        "-d", "--depth", type=int, default=DEFAULT_DEPTH, help="search depth"
+    )
+    parser.add_argument(
+        "-p",
+        "--position",
+        action="append",
+        choices=sorted(perft.POSITIONS),
+        help="perft reference position to time, may be repeated "
+        f"(default: {', '.join(POSITIONS)})",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        nargs="+",
+        help="worker counts to time, by default 1 and doubling up to all cores",
+    )
+    args = parser.parse_args(argv)
+    worker_counts = args.jobs
+
+    if worker_counts is None:
+        cores = os.cpu_count() or 1
+        worker_counts = [1]
+
+        while worker_counts[-1] * 2 <= cores:
+            worker_counts.append(worker_counts[-1] * 2)
+
+        if worker_counts[-1] != cores:
+            worker_counts.append(cores)
+
+    print(f"{os.cpu_count()} cores, depth {args.depth}")
+    totals = [0.0] * (len(worker_counts) + 1)
+
+    for name in args.position or POSITIONS:
+        times = run(name, perft.POSITIONS[name][0], args.depth, worker_counts)
+        totals = [total + elapsed for total, elapsed in zip(totals, times)]
+
+    print(f"{'total':<12} serial      {totals[0]:27.2f}s")
+
+    for workers, total in zip(worker_counts, totals[1:]):
+        print(
+            f"{'total':<12} {workers:>2} workers  {total:27.2f}s  "
+            f"{totals[0] / total:5.2f}x"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""
+Checks the alpha-beta search against a plain full-window negamax to the same
+depth, which the windows, the transposition table and fail-soft bounds must
+not change the score of. Null-move pruning and late move reductions are off,
+as they change the tree on purpose. Run it from this folder:
+
+    python -m search_check                  # reference and random positions
+    python -m search_check -d 3 -n 10       # deeper, fewer random positions
+    python -m search_check --fen "8/8/8/4k3/8/8/3QK3/8 w - - 0 1"
+    python -m search_check -j 8             # eight processes
+
+Both searches end in the same quiescence search, the reference's with a full
+window. The random positions come from seeded random games, so a failure
+can be run again. The reference is slow: some random positions take minutes.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import chess_engine
+import perft
+from chess_ai import (
+    CHECKMATE,
+    SQUARE_VALUES,
+    STALEMATE,
+    Searcher,
+    weighted_score_board,
+)
+
+
+# Positions whose search scores came out wrong before
+POSITIONS = {
+    "middlegame": perft.POSITIONS["middlegame"][0],
+    "delta_pruning": "r2qk2r/p2pppb1/bpQ5/2PN2p1/1n2P2P/P7/2PK1PP1/R1B2B1R b k - 0 20",
+}
+DEFAULT_DEPTH = 2
+DEFAULT_RANDOM_POSITIONS = 60
+TOLERANCE = 1e-9
+
+
+def negamax(searcher, game_state, depth, turn):
+    """
+    Scores the position by searching every move to `depth` with a full
+    window, the way the alpha-beta search should come out.
+    """
+    if depth == 0:
+        return searcher.quiescence_search(game_state, -CHECKMATE, CHECKMATE, turn)
+
+    moves = game_state.get_valid_moves()
+
+    if not moves:  # Checkmate or stalemate
+        return turn * weighted_score_board(game_state)
+
+    max_score = -CHECKMATE
+
+    for move in moves:
+        game_state.make_move(move)
+
+        if game_state.is_repetition() or game_state.fifty_move_rule:
+            score = STALEMATE
+        else:
+            score = -negamax(searcher, game_state, depth - 1, -turn)
+
+        game_state.undo_move()
+        max_score = max(max_score, score)
+
+    return max_score
+
+
+def random_positions(count, seed=0):
+    """
+    Yields `count` FEN strings of positions reached by random games of 8 to
+    60 plies that aren't over.
+    """
+    rng = random.Random(seed)
+
+    while count > 0:
+        game_state = chess_engine.GameState()
+
+        for _ in range(rng.randint(8, 60)):
+            moves = game_state.get_valid_moves()
+
+            if not moves:
+                break
+
+            game_state.make_move(rng.choice(moves))
+
+        if game_state.get_valid_moves():
+            count -= 1
+            yield game_state.to_fen()
+
+
+def new_searcher(depth):
+    return Searcher(depth, null_move_pruning=False, late_move_reductions=False)
+
+
+def check(name, fen, depth):
+    """
+    Searches one position and returns a line with the alpha-beta score, the
+    reference score and the score of the move iterative deepening picks, and
+    whether they all agree.
+    """
+    game_state = chess_engine.GameState.from_fen(fen, square_values=SQUARE_VALUES)
+    turn = 1 if game_state.white_to_move else -1
+    start = time.perf_counter()
+
+    searcher = new_searcher(depth)
+    expected = negamax(searcher, game_state, depth, turn)
+    score = searcher.find_move_nega_max_alpha_beta(
+        game_state, game_state.get_valid_moves(), depth, -CHECKMATE, CHECKMATE, turn
+    )
+
+    move = new_searcher(depth).find_best_move_nega_max_alpha_beta(
+        game_state, game_state.get_valid_moves()
+    )
+    game_state.make_move(move)
+
+    if game_state.is_repetition() or game_state.fifty_move_rule:
+        move_score = STALEMATE
+    else:
+        move_score = -negamax(searcher, game_state, depth - 1, -turn)
+
+    game_state.undo_move()
+
+    elapsed = time.perf_counter() - start
+    passed = (
+        abs(score - expected) <= TOLERANCE and abs(move_score - expected) <= TOLERANCE
+    )
+    verdict = "ok" if passed else f"FAILED, expected {expected:g}"
+    line = (
+        f"{name:<24} depth {depth}  score {score:8g}  "
+        f"{move.get_chess_notation():<8} {move_score:8g}  {elapsed:7.2f}s  {verdict}"
+    )
+
+    return line, passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="search_check",
+        description="Checks alpha-beta search scores against a plain negamax.",
+    )
+    parser.add_argument(
+        "-d", "--depth", type=int, default=DEFAULT_DEPTH, help="search depth"
+    )
+    parser.add_argument(
+        "-n",
+        "--random",
+        type=int,
+        default=DEFAULT_RANDOM_POSITIONS,
+        help="random positions to check after the reference ones",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random games")
+    parser.add_argument("--fen", help="check this position only")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        nargs="?",
+        const=os.cpu_count(),
+        default=1,
+        help="worker processes, all the cores when no number is given",
+    )
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        jobs = [("fen", args.fen)]
+    else:
+        jobs = list(POSITIONS.items())
+        jobs += [
+            (f"random {index}", fen)
+            for index, fen in enumerate(random_positions(args.random, args.seed))
+        ]
+
+    names, fens = zip(*jobs)
+    depths = [args.depth] * len(jobs)
+    passed = True
+
+    with ProcessPoolExecutor(args.jobs) as executor:
+        for line, ok in executor.map(check, names, fens, depths):
+            print(line, flush=True)
+            passed &= ok
+
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""
+A fixed-size transposition table for the search, kept in flat arrays rather
+than a dict so its memory use is set once, up front.
+
+Each bucket has two entries: the first keeps the deepest search of the
+positions that map to it, the second always takes the latest store that
+didn't fit in the first one.
+"""
+
+from array import array
+
+
+EXACT, LOWER_BOUND, UPPER_BOUND = 1, 2, 3  # A bound of 0 marks an empty entry
+# Bytes per entry: the 64-bit key, the score as a double, and the best move,
+# depth and bound packed in 32 bits
+ENTRY_SIZE = 8 + 8 + 4
+MOVE_BITS = 15  # Enough for `Move.pack`
+
+
+class TranspositionTable:
+    """
+    Maps Zobrist keys to (depth, score, bound, packed best move) using about
+    `size_mb` megabytes. A best move of 0 means none was found.
+    """
+
+    def __init__(self, size_mb=16):
+        self.buckets = max(1, size_mb * (1 << 20) // (2 * ENTRY_SIZE))
+        self.keys = array("Q", bytes(16 * self.buckets))
+        self.scores = array("d", bytes(16 * self.buckets))
+        self.data = array("I", bytes(8 * self.buckets))
+
+    def probe(self, key):
+        index = key % self.buckets * 2
+
+        for slot in (index, index + 1):
+            data = self.data[slot]
+
+            if self.keys[slot] == key and data:
+                return (
+                    data >> (MOVE_BITS + 2),
+                    self.scores[slot],
+                    data >> MOVE_BITS & 3,
+                    data & ((1 << MOVE_BITS) - 1),
+                )
+
+        return None
+
+    def store(self, key, depth, score, bound, move=0):
+        index = key % self.buckets * 2
+        slot = index
+
+        if self.keys[index] != key and depth < self.data[index] >> (MOVE_BITS + 2):
+            slot = index + 1
+
+        self.keys[slot] = key
+        self.scores[slot] = score
+        self.data[slot] = depth << (MOVE_BITS + 2) | bound << MOVE_BITS | move
+
+    def clear(self):
+        self.keys = array("Q", bytes(len(self.keys) * 8))
+        self.scores = array("d", bytes(len(self.scores) * 8))
+        self.data = array("I", bytes(len(self.data) * 4))
@@ -0,0 +1,65 @@
+"""
+Random keys for Zobrist hashing of chess positions.
+
+A position's key is the XOR of one key per piece on its square, one per
+castling right still held, one for the file of the en passant square and one
+when black is to move, so making a move only has to XOR the keys that change.
+The keys come from a fixed seed and are the same in every process.
+"""
+
+import random
+
+
+_random = random.Random(0x5A0B)
+
+PIECES = ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+# PIECE_KEYS[piece][row][col]
+PIECE_KEYS = {
+    piece: [[_random.getrandbits(64) for col in range(8)] for row in range(8)]
+    for piece in PIECES
+}
+CASTLING_KEYS = {
+    side: _random.getrandbits(64)
+    for side in ("w_kingside", "w_queenside", "b_kingside", "b_queenside")
+}
+# Indexed by the column of the en passant square
+EN_PASSANT_KEYS = [_random.getrandbits(64) for col in range(8)]
+BLACK_TO_MOVE = _random.getrandbits(64)
+
+
+def castling_key(castling_rights):
+    """
+    XOR of the keys of the rights a `Castling` object still holds.
+    """
+    key = 0
+
+    for side, side_key in CASTLING_KEYS.items():
+        if getattr(castling_rights, side):
+            key ^= side_key
+
+    return key
+
+
+def hash_position(game_state):
+    """
+    Computes the key of a `GameState` position from scratch. The en passant
+    square only counts when a pawn can take there.
+    """
+    key = castling_key(game_state.castling_rights)
+
+    for row in range(8):
+        for col in range(8):
+            piece = game_state.board[row][col]
+
+            if piece != "--":
+                key ^= PIECE_KEYS[piece][row][col]
+
+    en_passant = game_state.en_passant_possible
+
+    if en_passant and game_state.can_capture_en_passant(en_passant):
+        key ^= EN_PASSANT_KEYS[en_passant[1]]
+
+    if not game_state.white_to_move:
+        key ^= BLACK_TO_MOVE
+
+    return key